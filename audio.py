@@ -1,16 +1,31 @@
+from profiler import count
+from cache import get_file_hash, make_key, load_array, save_array, write_atomic
+from other import get_ext, FFMPEG_BIN
 import wave
-import pyaudio
-from spleeter.separator import Separator
-from spleeter.audio import STFTBackend
 import numpy as np
 from tqdm import tqdm
+import subprocess
+import json
 import os
 import sys
-import pickle
 
 SEPARATE_DICT = {0: 'drums.wav', 1: 'bass.wav', 2: 'vocals.wav', 3: 'other.wav'}
+SEPARATE_MODEL = 'spleeter:4stems' # Split to: Bass, Drums, Vocals, & Other
+SEPARATE_RATE = 44100
+SEPARATED_MARKER = 'separated.json' # Written last, a separated directory without it is incomplete
+DETECTORS = ['threshold', 'onset'] # threshold: separated instrument & saved thresholds, onset: spectral flux of the full song
+DECODE_RATE = 44100 # Sample rate non wav files are decoded at
+ONSET_BANDS = [(30, 150, 1.0), (150, 2000, 0.3), (2000, 12000, 0.7)] # (low Hz, high Hz, weight) kick drum, body, snare & hi-hats
+FRAME_DTYPES = {1: np.uint8, 2: np.int16, 4: np.int32, 8: np.int64} # Frame width [bytes] to dtype holding one frame
+
+def open_stream(audio_file, CHUNK_MUL=1, callback=None):
+    """
+    PyAudio output stream matching audio_file's format
+        - callback: PyAudio stream callback. The stream is non-blocking and PyAudio asks the callback for each buffer
+            of CHUNK frames from its own thread. Without a callback the stream is written to with stream.write
+    """
+    import pyaudio # Only needed for playback, keeps audio analysis usable without sound devices
 
-def open_stream(audio_file, CHUNK_MUL=1):
     CHUNK = 1024 * CHUNK_MUL
 
     wf = wave.open(audio_file, 'rb')
@@ -20,50 +35,79 @@ def open_stream(audio_file, CHUNK_MUL=1):
     stream = p.open(format=p.get_format_from_width(wf.getsampwidth()),
                     channels=wf.getnchannels(),
                     rate=wf.getframerate(),
-                    output=True)
+                    output=True,
+                    frames_per_buffer=CHUNK,
+                    stream_callback=callback)
 
     return stream, wf, CHUNK
 
-def get_saved_audio(file):
-    audio_pkl_filename = file.split('.')[0] + '.pkl'
-    if os.path.exists(audio_pkl_filename):
-        print('Saved audio data exists. Skipping preprocessing...')
-        saved_data = pickle.load(open(audio_pkl_filename, "rb"))
-        audio_data = saved_data['data']
-        CHUNK = saved_data['chunk']
-        RATE = saved_data['rate']
-
-        return audio_data, CHUNK, RATE
-
-def get_audio_data(file, save=True):
-    stream, wf, CHUNK = open_stream(file)
-    RATE = wf.getframerate()
+def play_audio_data(audio_file, audio_data):
+    """
+    Play audio data from get_audio_data on a non-blocking stream so playback never waits on the caller.
+    Returns (stream, cursor) where cursor[0] is the number of frames handed to the sound device so far.
+    Playback stops at the end of the data, check stream.is_active().
+    """
+    import pyaudio
 
-    with tqdm(total=wf.getnframes()) as pbar:
+    frames = audio_data.reshape(-1)
+    cursor = [0]
 
-        cnt = 0
-        while True:
-            # Read next frame
-            data = wf.readframes(CHUNK)
-            pbar.update(CHUNK)
-            if len(data) < CHUNK:
-                break
+    def callback(in_data, frame_count, time_info, status):
+        pos = cursor[0]
+        data = frames[pos:pos + frame_count]
+        cursor[0] = pos + len(data)
+        return data.tobytes(), pyaudio.paContinue if cursor[0] < len(frames) else pyaudio.paComplete
 
-            data_int = np.frombuffer(data, dtype=np.int32)  # Read bytes to int
-            data_int = np.resize(data_int, (1, CHUNK))  # Handle final CHUNK where size might be less than CHUNK size
+    stream, wf, CHUNK = open_stream(audio_file, callback=callback)
+    wf.close()
+    return stream, cursor
 
-            if cnt == 0:
-                all_data = data_int.copy()
-            else:
-                all_data = np.append(all_data, data_int, axis=0)
+def get_audio_cache_key(file, chunk=1024):
+    """
+    Cache key for a wav file's audio data. Changes when the file content, chunk size or sample rate changes.
+    """
+    with wave.open(file, 'rb') as wf:
+        RATE = wf.getframerate()
+    return make_key('audio', get_file_hash(file), chunk, RATE), RATE
+
+def get_saved_audio(file, chunk=1024):
+    key, RATE = get_audio_cache_key(file, chunk=chunk)
+    audio_data = load_array(key)
+    if audio_data is not None:
+        print('Saved audio data exists. Skipping preprocessing...')
+        return audio_data, chunk, RATE
 
-            cnt += 1
+def get_audio_data(file, save=True, chunk=1024, block_chunks=256):
+    """
+    Read a wav file in to a preallocated (n_chunks, chunk) array with one element per frame
+        - chunk: number of frames per row
+        - block_chunks: number of rows read from the file at a time
+    The final partial chunk is zero padded.
+    """
+    with wave.open(file, 'rb') as wf:
+        RATE = wf.getframerate()
+        frame_cnt = wf.getnframes()
+        frame_width = wf.getsampwidth() * wf.getnchannels()
+        assert frame_width in FRAME_DTYPES, f'Unsupported wav frame width of {frame_width} bytes in {file}.'
+
+        all_data = np.zeros((-(-frame_cnt // chunk), chunk), dtype=FRAME_DTYPES[frame_width])
+        flat_data = all_data.reshape(-1)
+
+        with tqdm(total=frame_cnt) as pbar:
+            pos = 0
+            while pos < frame_cnt:
+                data = np.frombuffer(wf.readframes(chunk * block_chunks), dtype=all_data.dtype)  # Read bytes to int
+                if len(data) == 0:
+                    break
+
+                flat_data[pos:pos + len(data)] = data
+                pos += len(data)
+                pbar.update(len(data))
 
     if save:
-        audio_pkl_filename = file.split('.')[0] + '.pkl'
-        pickle.dump({'data': all_data, 'chunk': CHUNK, 'rate': RATE}, open(audio_pkl_filename, "wb"))
+        save_array(get_audio_cache_key(file, chunk=chunk)[0], all_data)
 
-    return all_data, CHUNK, RATE
+    return all_data, chunk, RATE
 
 def fft_to_buckets(freq, PSD, buckets):
     """
@@ -80,21 +124,66 @@ def fft_to_buckets(freq, PSD, buckets):
 
     return freq_bucket, idxs
 
-def get_minmax_bucket_freq(audio_data, buckets, rate):
-    for i, data in enumerate(audio_data):
-        n = len(data)
-        fhat = np.fft.fft(data, n)
-        PSD = np.abs(fhat * np.conj(fhat) / n)  # Power Spectral Density
-        freq = (rate / n) * np.arange(n)
+def get_bucket_indices(n, buckets, rate):
+    """
+    Indices in an n point FFT closest to each bucket frequency. Same indices fft_to_buckets finds per CHUNK.
+    """
+    freq = (rate / n) * np.arange(n)
+    return sorted({np.abs(freq - i).argmin() for i in buckets})
 
-        fb, idxs = fft_to_buckets(freq, PSD, buckets)  # Chunk frequencies in to buckets
+def _psd_range_sum(PSD, start, stop, n):
+    """
+    Sum PSD between full FFT indices [start, stop) using only the one sided rfft PSD.
+    Indices past n/2 mirror back on to the positive frequencies since the audio data is real.
+    """
+    half = n // 2 + 1
+    total = np.zeros(PSD.shape[0])
+    if start < half:  # Positive frequencies
+        total += PSD[:, start:min(stop, half)].sum(axis=1)
+    if stop > half:  # Negative frequencies: index k has the same PSD as index n - k
+        total += PSD[:, n - stop + 1:n - max(start, half) + 1].sum(axis=1)
+    return total
+
+def get_bucket_spectra(audio_data, buckets, rate, block_size=4096):
+    """
+    Vectorized fft_to_buckets for every CHUNK in the track. Returns an array of shape (n_chunks, n_buckets)
+        - audio_data: (n_chunks, CHUNK) array of audio amplitudes
+        - buckets: a list of frequencies where each freq in the list will create a range between that freq and the previous
+            example - [100, 1000, 5000] Hz
+        - block_size: number of chunks transformed per rfft call, limits memory used on long tracks
+    """
+    n = audio_data.shape[1]
+    idxs = get_bucket_indices(n, buckets, rate)
+    bounds = list(zip(idxs, idxs[1:] + [n]))
 
-        if i == 0:
-            all_buckets = np.array(fb)
-        else:
-            all_buckets = np.vstack((all_buckets, fb))
+    spectra = np.empty((len(audio_data), len(bounds)))
+    count('ffts', len(audio_data))
+    for b in range(0, len(audio_data), block_size):
+        fhat = np.fft.rfft(audio_data[b:b + block_size], n, axis=1)
+        PSD = (fhat.real ** 2 + fhat.imag ** 2) / n  # Power Spectral Density
 
-    return np.min(all_buckets, axis=0), np.max(all_buckets, axis=0)
+        # Average PSD values in between frequencies defined by buckets
+        for j, (start, stop) in enumerate(bounds):
+            spectra[b:b + block_size, j] = _psd_range_sum(PSD, start, stop, n) / (stop - start)
+
+    return spectra
+
+def get_saved_bucket_spectra(file, audio_data, buckets, rate):
+    """
+    get_bucket_spectra for the audio data read from file, cached so it is only computed once per file & bucket set
+    """
+    key = make_key('spectra', get_file_hash(file), audio_data.shape[1], rate, [float(b) for b in buckets])
+    spectra = load_array(key)
+    if spectra is None:
+        spectra = get_bucket_spectra(audio_data, buckets, rate)
+        save_array(key, spectra)
+    return spectra
+
+def get_minmax_bucket_freq(audio_data, buckets, rate, spectra=None):
+    if spectra is None:
+        spectra = get_bucket_spectra(audio_data, buckets, rate)
+
+    return np.min(spectra, axis=0), np.max(spectra, axis=0)
 
 def get_audio_freqs_in_buckets(audio_data_chunk, buckets, rate):
     """
@@ -102,56 +191,174 @@ def get_audio_freqs_in_buckets(audio_data_chunk, buckets, rate):
         - buckets: a list of frequencies where each freq in the list will create a range between that freq and the previous
             example - [100, 1000, 5000] Hz
     """
+    return get_bucket_spectra(np.reshape(audio_data_chunk, (1, -1)), buckets, rate)[0]
 
-    n = len(audio_data_chunk)
-    fhat = np.fft.fft(audio_data_chunk, n)
-    PSD = np.abs(fhat * np.conj(fhat) / n)  # Power Spectral Density
-    freq = (rate / n) * np.arange(n)
+def get_threshold_crossings(spectra, thresholds, buckets_min, buckets_max):
+    """
+    Boolean array, True for each chunk where any bucket scaled between buckets_min & buckets_max is above its threshold.
+    Thresholds set to 0 are ignored.
+        - thresholds: dict or list of threshold per bucket index, as saved by set_audio_thresholds.py
+    """
+    thresholds = np.array([thresholds[i] for i in range(spectra.shape[1])], dtype=float)
+    buckets_min = np.asarray(buckets_min)
+    buckets_max = np.asarray(buckets_max)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scaled = (spectra - buckets_min) / (buckets_max - buckets_min)
+    return ((scaled > thresholds) & (thresholds > 0)).any(axis=1)
+
+def apply_refractory(frame_idxs, reset_frame_cnt):
+    """
+    Keep the first of frame_idxs then each next one at least reset_frame_cnt frames after the last one kept
+        - frame_idxs: sorted array of candidate frame indices
+    """
+    kept = []
+    i = 0
+    while i < len(frame_idxs):
+        kept += [frame_idxs[i]]
+        i = np.searchsorted(frame_idxs, frame_idxs[i] + reset_frame_cnt)
+    return kept
+
+def suggest_thresholds(spectra, buckets_min, buckets_max, rate, chunk=1024, cuts_per_min=60, quantile=None, min_reset=125, iterations=30):
+    """
+    Thresholds for every bucket without listening to the track. Each bucket's threshold is the same quantile of its
+    scaled spectrum, so every frequency range is above its threshold for the same share of the track.
+        - cuts_per_min: the quantile is binary searched until get_split_times would cut about this often
+        - quantile: use this quantile (0 to 1) directly instead of searching
+    Returns dict of threshold per bucket index, as saved by set_audio_thresholds.py
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scaled = np.nan_to_num((spectra - buckets_min) / (buckets_max - buckets_min))
+    min_reset_frame_cnt = int(min_reset / ((chunk / rate) * 1000)) + 2
+    minutes = len(spectra) * chunk / rate / 60
+
+    def thresholds_at(q):
+        # Thresholds of 0 are ignored by get_split_times, keep every bucket active
+        return dict(enumerate(np.maximum(np.quantile(scaled, q, axis=0), 1e-6).tolist()))
+
+    def cut_cnt(thresholds):
+        crossings = get_threshold_crossings(spectra, thresholds, buckets_min, buckets_max)
+        return len(apply_refractory(np.flatnonzero(crossings), min_reset_frame_cnt))
+
+    if quantile is not None:
+        return thresholds_at(quantile)
+
+    # Higher quantile, higher thresholds, fewer cuts
+    low, high = 0.0, 1.0
+    for _ in range(iterations):
+        q = (low + high) / 2
+        if cut_cnt(thresholds_at(q)) / minutes > cuts_per_min:
+            low = q
+        else:
+            high = q
 
-    fb, _ = fft_to_buckets(freq, PSD, buckets)  # Chunk frequencies in to buckets
-    return fb
+    return thresholds_at(high)
 
-def get_split_times(data, rate, thresholds, buckets, buckets_min, buckets_max, min_reset=125, chunk=1024, start_time=0, stop_time=0):
+def get_split_times(data, rate, thresholds, buckets, buckets_min, buckets_max, min_reset=125, chunk=1024, start_time=0, stop_time=0, spectra=None):
     '''
     min_reset [ms]: length of time (in ms) to wait before a new split can occur
     start_time[s]: start audio data here
     stop_time [s]: stop audio data here
+    spectra: precomputed get_bucket_spectra output for data, computed here if not given
     '''
+    if spectra is None:
+        spectra = get_bucket_spectra(data, buckets, rate)
+
     stop_time = len(data) * (chunk / rate) if stop_time == 0 else stop_time
 
     min_reset_frame_cnt = int(min_reset / ((chunk / rate) * 1000)) + 2
 
-    times = [start_time]
+    # Only chunks between start & stop times are checked
+    chunk_times = np.arange(len(data)) * chunk / rate
+    first = np.searchsorted(chunk_times, start_time, side='left')
+    last = np.searchsorted(chunk_times, stop_time, side='right')
 
-    i = 0
-    while True:
-        time = i * chunk / rate
+    crossings = get_threshold_crossings(spectra[first:last], thresholds, buckets_min, buckets_max)
+    split_idxs = apply_refractory(np.flatnonzero(crossings) + first, min_reset_frame_cnt)
 
-        freq_buckets = get_audio_freqs_in_buckets(data[i], buckets, rate)
+    return [start_time] + chunk_times[split_idxs].tolist() + [stop_time]
 
-        # Scale buckets
-        scaled = (freq_buckets - buckets_min) / (buckets_max - buckets_min)
+def get_mono_audio(file):
+    """
+    Song mixed down to mono float samples between -1 & 1. 8, 16 & 32 bit wav files are read directly,
+    anything else is decoded by ffmpeg at DECODE_RATE. Returns (samples, rate)
+    """
+    if get_ext(file) == 'wav':
+        with wave.open(file, 'rb') as wf:
+            sample_width = wf.getsampwidth()
+            if sample_width in (1, 2, 4):
+                rate = wf.getframerate()
+                data = np.frombuffer(wf.readframes(wf.getnframes()), dtype=FRAME_DTYPES[sample_width])
+                data = data.reshape(-1, wf.getnchannels()).mean(axis=1, dtype=np.float32)
+                if sample_width == 1: # 8 bit wav is unsigned
+                    return (data - 128) / 128, rate
+                return data / np.iinfo(FRAME_DTYPES[sample_width]).max, rate
+
+    cmd = [FFMPEG_BIN, '-loglevel', 'error', '-i', file, '-f', 's16le', '-ac', '1', '-ar', str(DECODE_RATE), '-']
+    data = np.frombuffer(subprocess.run(cmd, check=True, stdout=subprocess.PIPE).stdout, dtype=np.int16)
+    return data.astype(np.float32) / np.iinfo(np.int16).max, DECODE_RATE
+
+def get_onset_envelope(samples, rate, chunk=1024, bands=ONSET_BANDS, block_size=4096):
+    """
+    Percussive weighted spectral flux for every chunk of samples: how much each frequency got louder since the
+    previous chunk, summed with the weights in bands. Returns an array with one value per chunk.
+        - bands: (low Hz, high Hz, weight) list, frequencies outside every band are ignored
+    """
+    n_chunks = -(-len(samples) // chunk)
+    frames = np.zeros(n_chunks * chunk, dtype=np.float32)
+    frames[:len(samples)] = samples
+    frames = frames.reshape(n_chunks, chunk)
 
-        # If freq range is above threshold limit. Ignore thresholds set to 0
-        abv_thresh = any([(s > thresholds[s_idx]) and thresholds[s_idx] > 0 for s_idx, s in enumerate(scaled)])
+    freq = np.fft.rfftfreq(chunk, 1 / rate)
+    weights = np.zeros(len(freq), dtype=np.float32)
+    for low, high, weight in bands:
+        weights[(freq >= low) & (freq < high)] = weight
 
-        # Filter to start & stop times
-        if time >= start_time and time <= stop_time:
-            if abv_thresh:
-                times += [time]
-                i += min_reset_frame_cnt
-            else:
-                i += 1
-        else:
-            i += 1
+    window = np.hanning(chunk).astype(np.float32)
+    log_mag = np.empty((n_chunks, len(freq)), dtype=np.float32)
+    count('ffts', n_chunks)
+    for b in range(0, n_chunks, block_size):
+        log_mag[b:b + block_size] = np.log1p(100 * np.abs(np.fft.rfft(frames[b:b + block_size] * window, axis=1)))
+
+    return np.maximum(np.diff(log_mag, axis=0, prepend=log_mag[:1]), 0) @ weights
 
-        # If No More data
-        if i >= len(data):
-            # Add final time
-            times += [stop_time]
-            break
+def get_saved_onset_envelope(file, chunk=1024):
+    """
+    get_onset_envelope of a song, cached so the song is only decoded once. Returns (envelope, rate)
+    """
+    if get_ext(file) == 'wav':
+        with wave.open(file, 'rb') as wf:
+            rate = wf.getframerate() if wf.getsampwidth() in (1, 2, 4) else DECODE_RATE
+    else:
+        rate = DECODE_RATE
 
-    return times
+    key = make_key('onset', get_file_hash(file), chunk, rate, ONSET_BANDS)
+    envelope = load_array(key)
+    if envelope is None:
+        samples, rate = get_mono_audio(file)
+        envelope = get_onset_envelope(samples, rate, chunk=chunk)
+        save_array(key, envelope)
+    return envelope, rate
+
+def get_onset_split_times(envelope, rate, chunk=1024, sensitivity=1.5, min_reset=125, start_time=0, stop_time=0, window=0.5):
+    """
+    Split times at peaks of an onset envelope, same format as get_split_times
+        - sensitivity: standard deviations of the envelope a peak must be above its local average, higher for fewer cuts
+        - window [s]: length of the local average
+    """
+    stop_time = len(envelope) * (chunk / rate) if stop_time == 0 else stop_time
+    min_reset_frame_cnt = int(min_reset / ((chunk / rate) * 1000)) + 2
+
+    width = max(int(window * rate / chunk), 1)
+    local_mean = np.convolve(envelope, np.ones(width) / width, 'same')
+    padded = np.pad(envelope, 1, mode='edge')
+    is_peak = (envelope >= padded[:-2]) & (envelope >= padded[2:]) & (envelope > local_mean + sensitivity * np.std(envelope))
+
+    chunk_times = np.arange(len(envelope)) * chunk / rate
+    first = np.searchsorted(chunk_times, start_time, side='left')
+    last = np.searchsorted(chunk_times, stop_time, side='right')
+    split_idxs = apply_refractory(np.flatnonzero(is_peak[first:last]) + first, min_reset_frame_cnt)
+
+    return [start_time] + chunk_times[split_idxs].tolist() + [stop_time]
 
 def moving_average(x, width=10):
     return np.convolve(x, np.ones(width), 'valid') / width
@@ -160,23 +367,81 @@ def is_increasing(data):
     data = moving_average(data, width=400)
     return np.mean(np.diff(data, n=2)) > 0
 
-def separate_audio_tracks(audio_file, save_dir=None, use_gpu=True):
-    if not save_dir:
-        save_dir = os.path.join('Media', 'Audio', 'Separated')
-    if use_gpu:
-        os.environ["CUDA_VISIBLE_DEVICES"] = "1"
-    else:
-        os.environ["CUDA_VISIBLE_DEVICES"] = "-1"
-
-    audio_filename = os.path.split(audio_file)[1]
-    print('audio_filename', audio_filename)
-    separated_path = os.path.join(save_dir, audio_filename.split('.')[0])
-    print('separated_path', separated_path)
-    if os.path.exists(separated_path) and len(os.listdir(separated_path)) > 0:
-        print('Separated tracks found. Skipping audio track separation.')
-    else:
-        print('Separating music in to drums, bass, vocals, & other and saving in save_dir.')
+_separators = {}
+
+def get_separator(model=SEPARATE_MODEL, use_gpu=True):
+    """
+    Spleeter separator for model, loaded once per process and reused for every song
+    """
+    if model not in _separators:
+        os.environ["CUDA_VISIBLE_DEVICES"] = "1" if use_gpu else "-1" # Read when TensorFlow first loads
+        from spleeter.separator import Separator # Slow import, only needed when separating
+
         mult = False if 'win' in sys.platform else True # Handle windows lack of support for multiprocess module
-        separator = Separator('spleeter:4stems', multiprocess=mult)  # Split to: Bass, Drums, Vocals, & Other
-        separator.separate_to_file(audio_file, save_dir, synchronous=True)
-    return os.path.join(save_dir, audio_filename.split('.')[0])
\ No newline at end of file
+        _separators[model] = Separator(model, multiprocess=mult)
+    return _separators[model]
+
+def write_wav(f, data, rate):
+    """
+    Write (n_samples, channels) float audio between -1 & 1 as 16 bit wav to an open binary file
+    """
+    with wave.open(f, 'wb') as wf:
+        wf.setnchannels(data.shape[1])
+        wf.setsampwidth(2)
+        wf.setframerate(rate)
+        wf.writeframes((np.clip(data, -1, 1) * 32767).astype(np.int16).tobytes())
+
+def get_separated_stems(separated_path, file_hash):
+    """
+    Stems already separated in to separated_path from audio with content hash file_hash
+    """
+    try:
+        with open(os.path.join(separated_path, SEPARATED_MARKER), 'r') as f:
+            marker = json.load(f)
+    except (OSError, ValueError):
+        return set()
+    if marker.get('hash') != file_hash:
+        return set()
+    return {stem for stem in marker['stems'] if os.path.exists(os.path.join(separated_path, stem))}
+
+def separate_audio_queue(audio_files, save_dir=None, stems=None, use_gpu=True):
+    """
+    Separate each song in audio_files, yielding (audio_file, separated_path) as each one is ready. The Spleeter model
+    stays loaded between songs so audio_files can be a long list or a generator fed from a queue.
+        - stems: filenames from SEPARATE_DICT to write, all stems if None
+    A song is only separated again if its content changes or a stem not written before is needed.
+    """
+    save_dir = save_dir if save_dir else os.path.join('Media', 'Audio', 'Separated')
+    stems = stems if stems else list(SEPARATE_DICT.values())
+
+    for audio_file in audio_files:
+        audio_filename = os.path.split(audio_file)[1]
+        separated_path = os.path.join(save_dir, audio_filename.split('.')[0])
+        file_hash = get_file_hash(audio_file)
+        done = get_separated_stems(separated_path, file_hash)
+
+        if set(stems) <= done:
+            print(f'Separated tracks found in {separated_path}. Skipping audio track separation.')
+        else:
+            print(f'Separating {audio_filename} in to {", ".join(stems)} and saving in {separated_path}.')
+            from spleeter.audio.adapter import AudioAdapter
+
+            separator = get_separator(use_gpu=use_gpu)
+            waveform, _ = AudioAdapter.default().load(audio_file, sample_rate=SEPARATE_RATE)
+            prediction = separator.separate(waveform)
+
+            os.makedirs(separated_path, exist_ok=True)
+            for stem in stems:
+                data = prediction[stem.split('.')[0]]
+                write_atomic(os.path.join(separated_path, stem), lambda f: write_wav(f, data, SEPARATE_RATE))
+
+            marker = {'hash': file_hash, 'stems': sorted(done | set(stems))}
+            write_atomic(os.path.join(separated_path, SEPARATED_MARKER), lambda f: f.write(json.dumps(marker).encode()))
+
+        yield audio_file, separated_path
+
+def separate_audio_tracks(audio_file, save_dir=None, use_gpu=True, stems=None):
+    """
+    Separate one song, see separate_audio_queue. Returns the directory holding the separated stems.
+    """
+    return next(separate_audio_queue([audio_file], save_dir=save_dir, stems=stems, use_gpu=use_gpu))[1]
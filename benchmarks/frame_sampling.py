@@ -0,0 +1,44 @@
+"""
+Compare scene detection frame sampling speed: one full resolution frame at a time vs downscaled decord batches.
+
+    python benchmarks/frame_sampling.py [video1.mp4 video2.mp4 ...]
+
+Without videos, 1080p & 4K test videos are generated with ffmpeg in Media/Benchmarks/.
+"""
+import os
+import sys
+import time
+import subprocess
+import numpy as np
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from video import get_frame_means, SCAN_SIZE, SCAN_BATCH_SIZE
+from other import FFMPEG_BIN
+
+BENCH_DIR = os.path.join('Media', 'Benchmarks')
+TEST_SIZES = {'1080p': (1920, 1080), '4k': (3840, 2160)}
+TEST_DURATION = 60 # [s]
+
+def make_test_video(name, size, duration=TEST_DURATION, fps=30):
+    path = os.path.join(BENCH_DIR, f'sampling_{name}.mp4')
+    if not os.path.exists(path):
+        os.makedirs(BENCH_DIR, exist_ok=True)
+        subprocess.run([FFMPEG_BIN, '-y', '-loglevel', 'error', '-f', 'lavfi',
+                        '-i', f'testsrc2=size={size[0]}x{size[1]}:rate={fps}:duration={duration}',
+                        '-c:v', 'libx264', '-preset', 'veryfast', '-pix_fmt', 'yuv420p', path], check=True)
+    return path
+
+def time_sampling(path, **kwargs):
+    start = time.perf_counter()
+    means, times = get_frame_means(path, **kwargs)
+    elapsed = time.perf_counter() - start
+    return means, len(means) / elapsed
+
+if __name__ == '__main__':
+    paths = sys.argv[1:] if len(sys.argv) > 1 else [make_test_video(n, s) for n, s in TEST_SIZES.items()]
+
+    for path in paths:
+        # Random access for both, auto could pick sequential decoding which ignores batch_size
+        single_means, single_fps = time_sampling(path, scan_size=None, batch_size=0, scan_mode='random')
+        batch_means, batch_fps = time_sampling(path, scan_size=SCAN_SIZE, batch_size=SCAN_BATCH_SIZE, scan_mode='random')
+        print(f'{path}: per frame {single_fps:.1f} frames/s, batched {SCAN_SIZE[0]}x{SCAN_SIZE[1]} {batch_fps:.1f} frames/s '
+              f'({batch_fps / single_fps:.1f}x). Max mean difference {np.max(np.abs(single_means - batch_means)):.2f}')
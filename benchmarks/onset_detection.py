@@ -0,0 +1,69 @@
+"""
+Compare the onset detector on the full song against Spleeter separation + thresholds: runtime and how many cuts agree.
+
+    python benchmarks/onset_detection.py "Media/Audio/song.wav" [-sensitivity 1.5] [-instrument 0]
+
+Thresholds saved by set_audio_thresholds.py are used if found, otherwise they are suggested to cut as often as the
+onset detector. Separation is only timed when the song has not been separated before.
+"""
+import os
+import sys
+import time
+import pickle
+import numpy as np
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from audio import (get_audio_data, get_bucket_spectra, get_minmax_bucket_freq, get_split_times, suggest_thresholds, separate_audio_tracks,
+                   get_mono_audio, get_onset_envelope, get_onset_split_times, SEPARATE_DICT)
+
+BUCKETS = [31.25 * 2 ** n for n in range(10)] # Same buckets as set_audio_thresholds.py
+CHUNK = 1024
+TOLERANCE = 0.05 # [s] Cuts this close together count as the same cut
+
+def match_cuts(times, reference, tolerance=TOLERANCE):
+    """
+    Number of times within tolerance of a reference time
+    """
+    if len(times) == 0 or len(reference) == 0:
+        return 0
+    reference = np.asarray(reference)
+    idxs = np.clip(np.searchsorted(reference, times), 1, len(reference) - 1)
+    nearest = np.minimum(np.abs(times - reference[idxs - 1]), np.abs(times - reference[idxs]))
+    return int(np.sum(nearest <= tolerance))
+
+if __name__ == '__main__':
+    music_file = sys.argv[1]
+    sensitivity = float(sys.argv[sys.argv.index('-sensitivity') + 1]) if '-sensitivity' in sys.argv else 1.5
+    instrument = SEPARATE_DICT[int(sys.argv[sys.argv.index('-instrument') + 1])] if '-instrument' in sys.argv else 'drums.wav'
+
+    start = time.perf_counter()
+    samples, rate = get_mono_audio(music_file)
+    onset_times = get_onset_split_times(get_onset_envelope(samples, rate, chunk=CHUNK), rate, chunk=CHUNK, sensitivity=sensitivity)[1:-1]
+    onset_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    separated_file = os.path.join(separate_audio_tracks(music_file, stems=[instrument]), instrument)
+    separate_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    audio_data, chunk, rate = get_audio_data(separated_file, save=False, chunk=CHUNK)
+    thresh_path = os.path.join(os.path.dirname(separated_file), 'saved_thresholds.pkl')
+    if os.path.exists(thresh_path):
+        saved = pickle.load(open(thresh_path, 'rb'))
+        spectra = get_bucket_spectra(audio_data, saved['buckets'], rate)
+        args = (saved['thresholds'], saved['buckets'], saved['min_buckets'], saved['max_buckets'])
+    else:
+        spectra = get_bucket_spectra(audio_data, BUCKETS, rate)
+        buckets_min, buckets_max = get_minmax_bucket_freq(audio_data, BUCKETS, rate, spectra=spectra)
+        cuts_per_min = len(onset_times) / (len(audio_data) * chunk / rate / 60)
+        thresholds = suggest_thresholds(spectra, buckets_min, buckets_max, rate, chunk=chunk, cuts_per_min=cuts_per_min)
+        args = (thresholds, BUCKETS, buckets_min, buckets_max)
+    threshold_times = get_split_times(audio_data, rate, *args, chunk=chunk, spectra=spectra)[1:-1]
+    threshold_time = time.perf_counter() - start
+
+    matched = match_cuts(np.array(onset_times), threshold_times)
+    precision = matched / max(len(onset_times), 1)
+    recall = match_cuts(np.array(threshold_times), onset_times) / max(len(threshold_times), 1)
+    print(f'Onset: {len(onset_times)} cuts in {onset_time:.2f}s')
+    print(f'Separation + threshold: {len(threshold_times)} cuts in {separate_time + threshold_time:.2f}s '
+          f'(separation {separate_time:.2f}s, thresholds {"saved" if os.path.exists(thresh_path) else "suggested"})')
+    print(f'Agreement within {TOLERANCE * 1000:.0f}ms: {precision:.0%} of onset cuts, {recall:.0%} of threshold cuts')
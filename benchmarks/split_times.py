@@ -0,0 +1,86 @@
+"""
+Check the vectorized get_split_times returns the same times as the original per chunk loop, and compare their speed.
+
+    python benchmarks/split_times.py [Media/Audio/Separated/song/drums.wav ...]
+
+Without audio files a corpus of random spectra, thresholds, start & stop times is used.
+"""
+import os
+import sys
+import time
+import numpy as np
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from audio import get_split_times, get_audio_data, get_bucket_spectra, get_minmax_bucket_freq, get_bucket_indices
+
+RATE = 44100
+CHUNK = 1024
+BUCKETS = [100, 1000, 5000, 10000]
+RANDOM_CASES = 200
+
+def legacy_split_times(data, rate, thresholds, buckets_min, buckets_max, spectra, min_reset=125, chunk=1024, start_time=0, stop_time=0):
+    """
+    get_split_times as it was before vectorizing, one chunk at a time
+    """
+    stop_time = len(data) * (chunk / rate) if stop_time == 0 else stop_time
+    min_reset_frame_cnt = int(min_reset / ((chunk / rate) * 1000)) + 2
+    times = [start_time]
+    i = 0
+    while True:
+        time = i * chunk / rate
+        scaled = (spectra[i] - buckets_min) / (buckets_max - buckets_min)
+        abv_thresh = any([(s > thresholds[s_idx]) and thresholds[s_idx] > 0 for s_idx, s in enumerate(scaled)])
+        if time >= start_time and time <= stop_time:
+            if abv_thresh:
+                times += [time]
+                i += min_reset_frame_cnt
+            else:
+                i += 1
+        else:
+            i += 1
+        if i >= len(data):
+            times += [stop_time]
+            break
+    return times
+
+def random_case(rng):
+    n_chunks = rng.integers(1, 20000)
+    n_buckets = len(get_bucket_indices(CHUNK, BUCKETS, RATE))  # Same column count get_bucket_spectra returns
+    spectra = rng.gamma(1, size=(n_chunks, n_buckets)) ** 3
+    buckets_min, buckets_max = spectra.min(axis=0), spectra.max(axis=0)
+    thresholds = {i: float(rng.choice([0, rng.random()])) for i in range(spectra.shape[1])}
+    duration = n_chunks * CHUNK / RATE
+    start_time, stop_time = sorted(rng.choice([0, rng.random() * duration], size=2))
+    return spectra, thresholds, buckets_min, buckets_max, float(start_time), float(stop_time)
+
+def file_cases(paths, rng):
+    for path in paths:
+        audio_data, _, rate = get_audio_data(path, save=False, chunk=CHUNK)
+        spectra = get_bucket_spectra(audio_data, BUCKETS, rate)
+        buckets_min, buckets_max = get_minmax_bucket_freq(audio_data, BUCKETS, rate, spectra=spectra)
+        for _ in range(5):
+            thresholds = {i: float(rng.random()) for i in range(spectra.shape[1])}
+            yield spectra, thresholds, buckets_min, buckets_max, 0, 0
+
+if __name__ == '__main__':
+    rng = np.random.default_rng(0)
+    cases = file_cases(sys.argv[1:], rng) if len(sys.argv) > 1 else (random_case(rng) for _ in range(RANDOM_CASES))
+
+    legacy_time = new_time = 0
+    mismatches = 0
+    for cnt, (spectra, thresholds, buckets_min, buckets_max, start_time, stop_time) in enumerate(cases):
+        data = np.empty((len(spectra), 0))  # Only the chunk count is used once spectra are given
+        args = (thresholds, BUCKETS, buckets_min, buckets_max)
+
+        start = time.perf_counter()
+        expected = legacy_split_times(data, RATE, thresholds, buckets_min, buckets_max, spectra, chunk=CHUNK, start_time=start_time, stop_time=stop_time)
+        legacy_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        result = get_split_times(data, RATE, *args, chunk=CHUNK, start_time=start_time, stop_time=stop_time, spectra=spectra)
+        new_time += time.perf_counter() - start
+
+        if result != expected:
+            mismatches += 1
+            print(f'Case {cnt}: {len(result)} times, expected {len(expected)}')
+
+    print(f'{cnt + 1} cases, {mismatches} mismatches. Loop {legacy_time:.2f}s, vectorized {new_time:.2f}s ({legacy_time / new_time:.0f}x)')
@@ -0,0 +1,195 @@
+"""
+Time the audio & video hot paths on synthetic media with known cuts and check the results against them.
+
+    python benchmarks/suite.py [-full] [-workers 4] [-o results.json] [-compare benchmarks/results/abc1234.json]
+
+Click track songs (1, 3 & 10 minutes) and videos of solid color scenes (10 & 100 videos, 1000 with -full) are made once
+in Media/Benchmarks/suite/. Results are saved to benchmarks/results/<commit>.json, -compare prints the change from an
+earlier run. Caches are written to a temporary directory so every run decodes & analyses from scratch.
+"""
+import os
+import sys
+import json
+import wave
+import time
+import platform
+import tempfile
+import subprocess
+import numpy as np
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import cache
+from audio import get_audio_data, get_bucket_spectra, get_minmax_bucket_freq, get_split_times
+from video import scan_videos, plan_musicvideo_cuts
+from render import render_ffmpeg
+from other import shuffle_in_chunks, FFMPEG_BIN
+
+SUITE_DIR = os.path.join('Media', 'Benchmarks', 'suite')
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+SONG_MINUTES = [1, 3, 10]
+VIDEO_COUNTS = [10, 100]
+FULL_VIDEO_COUNTS = [10, 100, 1000]
+SHUFFLE_SIZES = [1000, 10000, 100000]
+BPM = 128
+RATE = 44100
+CHUNK = 1024
+BUCKETS = [31.25 * 2 ** n for n in range(10)] # Same buckets as set_audio_thresholds.py
+CLICK_THRESHOLDS = {i: 0.3 for i in range(len(BUCKETS))}
+VIDEO_SIZE = (320, 180)
+VIDEO_FPS = 30
+SCENE_LENS = [3.0, 4.5, 2.5] # [s] Scenes per video, cut times are known
+SCENE_LEVELS = [30, 200, 110, 250, 60] # Gray level of each scene, far enough apart for any split threshold
+CHECK_FREQ = 1
+
+def make_click_track(minutes, bpm=BPM):
+    """
+    Stereo 16 bit wav with a click on every beat over quiet noise. Returns (path, beat times [s])
+    """
+    path = os.path.join(SUITE_DIR, f'clicks_{minutes}min_{bpm}bpm.wav')
+    beats = np.arange(0.25, minutes * 60 - 0.25, 60 / bpm)
+    if not os.path.exists(path):
+        os.makedirs(SUITE_DIR, exist_ok=True)
+        rng = np.random.default_rng(0)
+        samples = rng.normal(scale=50, size=minutes * 60 * RATE)
+        click = rng.normal(scale=12000, size=int(0.01 * RATE)) * np.exp(-np.arange(int(0.01 * RATE)) / (0.002 * RATE))
+        for beat in beats:
+            start = int(beat * RATE)
+            samples[start:start + len(click)] += click
+        frames = np.repeat(np.clip(samples, -32768, 32767).astype(np.int16)[:, None], 2, axis=1)
+
+        with wave.open(path, 'wb') as wf:
+            wf.setnchannels(2)
+            wf.setsampwidth(2)
+            wf.setframerate(RATE)
+            wf.writeframes(frames.tobytes())
+    return path, beats
+
+def make_scene_video(idx):
+    """
+    Video of solid gray scenes SCENE_LENS long made with ffmpeg. Returns (path, cut times [s])
+    """
+    path = os.path.join(SUITE_DIR, f'scenes_{idx:04d}.mp4')
+    cuts = np.cumsum(SCENE_LENS)[:-1]
+    if not os.path.exists(path):
+        os.makedirs(SUITE_DIR, exist_ok=True)
+        levels = [SCENE_LEVELS[(idx + k) % len(SCENE_LEVELS)] for k in range(len(SCENE_LENS))]
+        inputs = []
+        for level, scene_len in zip(levels, SCENE_LENS):
+            inputs += ['-f', 'lavfi', '-i', f'color=c=0x{level:02x}{level:02x}{level:02x}:s={VIDEO_SIZE[0]}x{VIDEO_SIZE[1]}:r={VIDEO_FPS}:d={scene_len}']
+        concat = ''.join(f'[{k}:v]' for k in range(len(SCENE_LENS))) + f'concat=n={len(SCENE_LENS)}:v=1:a=0[v]'
+        subprocess.run([FFMPEG_BIN, '-y', '-loglevel', 'error'] + inputs + ['-filter_complex', concat, '-map', '[v]',
+                        '-c:v', 'libx264', '-preset', 'ultrafast', '-g', str(VIDEO_FPS), '-pix_fmt', 'yuv420p', path], check=True)
+    return path, cuts
+
+def match_times(found, expected, early=0.0, late=0.05):
+    """
+    Number of found times within [expected - early, expected + late] of an expected time
+    """
+    expected = np.asarray(expected)
+    idxs = np.searchsorted(expected, np.asarray(found) + early, side='right') - 1
+    return int(np.sum((idxs >= 0) & (np.asarray(found) - expected[np.maximum(idxs, 0)] <= late)))
+
+def timed(results, name, fn, *args, **kwargs):
+    start = time.perf_counter()
+    out = fn(*args, **kwargs)
+    results[name] = {'seconds': time.perf_counter() - start}
+    print(f'{name}: {results[name]["seconds"]:.3f}s')
+    return out
+
+def check(results, name, ok, detail):
+    results[name].update({'ok': bool(ok), 'detail': detail})
+    if not ok:
+        print(f'  FAILED: {detail}')
+
+def bench_audio(results):
+    for minutes in SONG_MINUTES:
+        path, beats = make_click_track(minutes)
+
+        audio_data, chunk, rate = timed(results, f'get_audio_data_{minutes}min', get_audio_data, path, save=False, chunk=CHUNK)
+
+        spectra = timed(results, f'get_bucket_spectra_{minutes}min', get_bucket_spectra, audio_data, BUCKETS, rate)
+        buckets_min, buckets_max = timed(results, f'get_minmax_bucket_freq_{minutes}min', get_minmax_bucket_freq, audio_data, BUCKETS, rate, spectra=spectra)
+
+        split_times = timed(results, f'get_split_times_{minutes}min', get_split_times, audio_data, rate, CLICK_THRESHOLDS, BUCKETS,
+                            buckets_min, buckets_max, chunk=chunk, spectra=spectra)
+        found = split_times[1:-1]
+        matched = match_times(found, beats, early=chunk / rate, late=chunk / rate) # Chunk holding the click starts up to a chunk before it
+        check(results, f'get_split_times_{minutes}min', matched == len(found) == len(beats), f'{matched} of {len(found)} cuts on {len(beats)} beats')
+
+def bench_videos(results, video_counts, workers):
+    videos = [make_scene_video(idx) for idx in range(max(video_counts))]
+
+    for video_cnt in video_counts:
+        paths = [path for path, _ in videos[:video_cnt]]
+        scanned = timed(results, f'get_video_split_times_{video_cnt}videos', lambda: dict(scan_videos(paths, check_freq=CHECK_FREQ, split_thresh=10, workers=workers)))
+
+        missed = 0
+        for path, cuts in videos[:video_cnt]:
+            found = [start for start, _ in scanned[path][1:]]
+            # Scenes are found at the first sample after each cut, the last cut ends the final clip returned
+            missed += len(cuts) - 1 - match_times(found, cuts, late=CHECK_FREQ)
+        check(results, f'get_video_split_times_{video_cnt}videos', missed == 0, f'{missed} scene cuts missed')
+
+        # Planning only, split times known so no video is decoded
+        known = {path: list(zip([0] + list(cuts), list(cuts) + [sum(SCENE_LENS)])) for path, cuts in videos[:video_cnt]}
+        _, beats = make_click_track(3)
+        audio_split_times = [0] + beats.tolist()
+        for match in ['sequential', 'pool']:
+            cuts = timed(results, f'plan_{match}_{video_cnt}videos', plan_musicvideo_cuts, paths, audio_split_times, known_split_times=known, match=match)
+            check(results, f'plan_{match}_{video_cnt}videos', len(cuts) == len(audio_split_times) - 1, f'{len(cuts)} of {len(audio_split_times) - 1} audio cuts filled')
+
+def bench_shuffle(results):
+    for size in SHUFFLE_SIZES:
+        items = list(range(size))
+        shuffled = timed(results, f'shuffle_in_chunks_{size}', shuffle_in_chunks, items, chunk_size=20)
+        check(results, f'shuffle_in_chunks_{size}', sorted(shuffled) == items[:len(shuffled)], f'{len(shuffled)} items kept')
+
+def bench_render(results):
+    videos = [make_scene_video(idx) for idx in range(10)]
+    path, beats = make_click_track(1)
+    durations = np.diff([0] + beats[beats < 20].tolist())
+    cuts = [(videos[k % len(videos)][0], 0.0, float(duration)) for k, duration in enumerate(durations)]
+
+    filename = os.path.join(tempfile.gettempdir(), 'benchmark_render.mp4')
+    timed(results, 'render_ffmpeg_20s', render_ffmpeg, cuts, filename, music_file=path, size=(640, 360))
+    probe = subprocess.run(['ffprobe', '-v', 'error', '-show_entries', 'format=duration', '-of', 'csv=p=0', filename], stdout=subprocess.PIPE, text=True)
+    duration = float(probe.stdout.strip() or 0)
+    check(results, 'render_ffmpeg_20s', abs(duration - durations.sum()) < 0.1, f'{duration:.2f}s rendered for {durations.sum():.2f}s of cuts')
+    os.remove(filename)
+
+def get_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], stdout=subprocess.PIPE, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def compare(results, old_filename):
+    old = json.load(open(old_filename, 'r'))
+    print(f'\nCompared to {old["commit"]} ({old_filename}):')
+    for name, result in results.items():
+        if name in old['results']:
+            ratio = result['seconds'] / max(old['results'][name]['seconds'], 1e-9)
+            print(f'{name:40s} {old["results"][name]["seconds"]:9.3f}s -> {result["seconds"]:9.3f}s  ({ratio:.2f}x)')
+
+if __name__ == '__main__':
+    args = sys.argv
+    workers = int(args[args.index('-workers') + 1]) if '-workers' in args else 1
+    video_counts = FULL_VIDEO_COUNTS if '-full' in args else VIDEO_COUNTS
+    commit = get_commit()
+    out_filename = args[args.index('-o') + 1] if '-o' in args else os.path.join(RESULTS_DIR, f'{commit}.json')
+
+    results = {}
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache.CACHE_DIR = cache_dir
+        bench_audio(results)
+        bench_videos(results, video_counts, workers)
+        bench_shuffle(results)
+        bench_render(results)
+
+    os.makedirs(os.path.dirname(os.path.abspath(out_filename)), exist_ok=True)
+    with open(out_filename, 'w') as f:
+        json.dump({'commit': commit, 'date': time.strftime('%Y-%m-%d %H:%M:%S'), 'platform': platform.platform(),
+                   'python': platform.python_version(), 'workers': workers, 'results': results}, f, indent=1)
+    print(f'{sum(r.get("ok", True) for r in results.values())} of {len(results)} checks passed. Results saved to {out_filename}')
+
+    if '-compare' in args:
+        compare(results, args[args.index('-compare') + 1])
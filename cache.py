@@ -0,0 +1,175 @@
+from contextlib import contextmanager
+import numpy as np
+import hashlib
+import json
+import os
+import time
+import threading
+
+CACHE_DIR = os.path.join('Media', 'Cache')
+CACHE_MAX_BYTES = 10 * 1024 ** 3 # Least recently used files are deleted once the cache grows past this size
+MANIFEST_FILENAME = 'manifest.json'
+LOCK_TIMEOUT = 60 # [s] Manifest lock older than this is assumed left behind by a crashed process
+
+_hash_memo = {}
+
+def write_atomic(path, write_fn):
+    """
+    Write to a temporary file then move it in to place so other processes never see a partially written file
+        - write_fn: function taking the open binary file object
+    """
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'  # Unique per thread, threads may write the same key
+    try:
+        with open(tmp_path, 'wb') as f:
+            write_fn(f)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+@contextmanager
+def _open_manifest(cache_dir=None):
+    """
+    Lock, load and yield the cache manifest. Changes made to the manifest are saved on exit.
+    The lock is a file created exclusively so the cache directory can be shared between processes & machines.
+    """
+    cache_dir = cache_dir if cache_dir else CACHE_DIR
+    os.makedirs(cache_dir, exist_ok=True)
+
+    lock_path = os.path.join(cache_dir, MANIFEST_FILENAME + '.lock')
+    while True:
+        try:
+            lock_fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(lock_path) > LOCK_TIMEOUT:
+                    os.remove(lock_path)
+            except OSError:
+                pass
+            time.sleep(0.01)
+
+    try:
+        manifest_path = os.path.join(cache_dir, MANIFEST_FILENAME)
+        manifest = {'entries': {}, 'files': {}}
+        if os.path.exists(manifest_path):
+            try:
+                manifest.update(json.load(open(manifest_path, 'r')))
+            except ValueError:
+                print(f'Cache manifest {manifest_path} unreadable. Starting a new manifest.')
+
+        yield manifest
+
+        write_atomic(manifest_path, lambda f: f.write(json.dumps(manifest).encode()))
+    finally:
+        os.close(lock_fd)
+        os.remove(lock_path)
+
+def _evict(cache_dir, manifest, max_bytes, keep=None):
+    """
+    Delete least recently used entries until the cache fits in max_bytes. Entry named keep is never deleted.
+    Pinned entries are never deleted and don't count towards max_bytes.
+    """
+    entries = manifest['entries']
+    unpinned = [name for name in entries if not entries[name].get('pinned')]
+    total = sum(entries[name]['size'] for name in unpinned)
+    for name in sorted(unpinned, key=lambda n: entries[n]['last_used']):
+        if total <= max_bytes:
+            break
+        if name == keep:
+            continue
+        try:
+            os.remove(os.path.join(cache_dir, name))
+        except FileNotFoundError:
+            pass
+        except OSError: # Still open by another process on Windows, try again next time
+            continue
+        total -= entries.pop(name)['size']
+
+def get_file_hash(path, cache_dir=None):
+    """
+    sha1 of a file's content. Remembered by path, size & modified time so unchanged files are only read once.
+    """
+    stat = os.stat(path)
+    abs_path = os.path.abspath(path)
+    file_id = (abs_path, stat.st_size, stat.st_mtime_ns)
+    if file_id in _hash_memo:
+        return _hash_memo[file_id]
+
+    with _open_manifest(cache_dir) as manifest:
+        known = manifest['files'].get(abs_path)
+
+    if known and (known['size'], known['mtime']) == (stat.st_size, stat.st_mtime_ns):
+        file_hash = known['hash']
+    else:
+        sha1 = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                sha1.update(block)
+        file_hash = sha1.hexdigest()
+
+        with _open_manifest(cache_dir) as manifest:
+            manifest['files'][abs_path] = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'hash': file_hash}
+
+    _hash_memo[file_id] = file_hash
+    return file_hash
+
+def make_key(*parts):
+    """
+    Cache key from any json serializable parts, example - make_key('audio', get_file_hash(path), chunk, rate)
+    """
+    return hashlib.sha1(json.dumps(parts).encode()).hexdigest()
+
+def get_cached_path(key, ext, cache_dir=None, pinned=False):
+    """
+    Path of the cached file for key or None if not cached. Marks the file as recently used.
+        - pinned: never evict the file from now on
+    """
+    cache_dir = cache_dir if cache_dir else CACHE_DIR
+    name = key + ext
+    path = os.path.join(cache_dir, name)
+    if not os.path.exists(path):
+        return None
+
+    with _open_manifest(cache_dir) as manifest:
+        entry = manifest['entries'].setdefault(name, {})
+        entry.update({'size': os.path.getsize(path), 'last_used': time.time()})
+        if pinned:
+            entry['pinned'] = True
+
+    return path
+
+def store_file(key, ext, write_fn, cache_dir=None, max_bytes=None, pinned=False):
+    """
+    Atomically write a file in to the cache and evict old files if the cache is over its size limit
+        - write_fn: function taking the open binary file object to write to
+        - pinned: never evict the file, for files other files refer to by path e.g. proxies saved in plans
+    """
+    cache_dir = cache_dir if cache_dir else CACHE_DIR
+    max_bytes = max_bytes if max_bytes else CACHE_MAX_BYTES
+    os.makedirs(cache_dir, exist_ok=True)
+
+    name = key + ext
+    path = os.path.join(cache_dir, name)
+    write_atomic(path, write_fn)
+
+    with _open_manifest(cache_dir) as manifest:
+        manifest['entries'][name] = {'size': os.path.getsize(path), 'last_used': time.time()}
+        if pinned:
+            manifest['entries'][name]['pinned'] = True
+        _evict(cache_dir, manifest, max_bytes, keep=name)
+
+    return path
+
+def save_array(key, array, cache_dir=None):
+    return store_file(key, '.npy', lambda f: np.save(f, array), cache_dir=cache_dir)
+
+def load_array(key, cache_dir=None, mmap=True):
+    """
+    Load a cached array, memory mapped read only by default so only the parts used are read from disk.
+    Returns None if the key is not cached.
+    """
+    path = get_cached_path(key, '.npy', cache_dir=cache_dir)
+    if path is None:
+        return None
+    return np.load(path, mmap_mode='r' if mmap else None)
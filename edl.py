@@ -0,0 +1,49 @@
+import json
+import os
+
+EDL_VERSION = 1
+
+def make_edl(cuts, audio_split_times, music_file, start_time=0, proxies=None):
+    """
+    Edit decision list: everything needed to render a music video, as plain json serializable data
+        cuts - (path, start_time, duration) list from plan_musicvideo_cuts, one per audio slot in order
+        audio_split_times - times [s] in music_file where each audio slot starts, the last value is where the video ends
+        proxies - dict of source path to low resolution proxy path from video.make_proxies, saved with each cut
+    """
+    edl = {'version': EDL_VERSION,
+           'music_file': music_file,
+           'start_time': float(start_time),
+           'stop_time': float(audio_split_times[-1]),
+           'cuts': [{'source': path, 'in': float(in_time), 'duration': float(duration), 'slot': slot, 'slot_time': float(audio_split_times[slot])}
+                    for slot, (path, in_time, duration) in enumerate(cuts)]}
+    if proxies:
+        for cut in edl['cuts']:
+            cut['proxy'] = proxies.get(cut['source'], cut['source'])
+    return edl
+
+def edl_to_cuts(edl, use_proxy=False):
+    """
+    (path, start_time, duration) cuts of an edit decision list
+        use_proxy - cut from proxies where the plan has them instead of full resolution sources. Proxies deleted since
+                    the plan was made are made again.
+    """
+    cuts = []
+    for cut in edl['cuts']:
+        path = cut['source']
+        if use_proxy and 'proxy' in cut:
+            path = cut['proxy']
+            if not os.path.exists(path):
+                from video import get_proxy # Only needed for missing proxies, keeps edl free of the video dependencies
+                path = cut['proxy'] = get_proxy(cut['source'])
+        cuts.append((path, cut['in'], cut['duration']))
+    return cuts
+
+def save_edl(edl, filename):
+    with open(filename, 'w') as f:
+        json.dump(edl, f, indent=1)
+
+def load_edl(filename):
+    with open(filename, 'r') as f:
+        edl = json.load(f)
+    assert edl.get('version') == EDL_VERSION, f'{filename} is not a version {EDL_VERSION} edit decision list.'
+    return edl
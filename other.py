@@ -2,6 +2,9 @@ from PIL import Image
 from matplotlib.pyplot import imshow, show
 import numpy as np
 import os
+import sys
+
+FFMPEG_BIN = 'ffmpeg' # ffmpeg must be installed & on PATH
 
 def print_frame(frame):
     img = Image.fromarray(frame)
@@ -18,6 +21,22 @@ def get_unique_filename(requested_name):
         i += 1
         new_name = name + str(i) + '.' + ext
     return new_name
+
+def get_unique_filenames(requested_name, count):
+    """
+    get_unique_filename for count files that will be written at the same time
+    """
+    names = []
+    i = 1
+    name = requested_name.split('.')[0]
+    ext = requested_name.split('.')[-1]
+    new_name = requested_name
+    while len(names) < count:
+        if not os.path.exists(new_name):
+            names += [new_name]
+        i += 1
+        new_name = name + str(i) + '.' + ext
+    return names
     
 def add_dirs_if_not_exists(dir_list):
     for dir in dir_list:
@@ -37,6 +56,10 @@ def get_default_files(path, extensions=None):
             return files
     return None
 
+def multiprocess_supported():
+    # Process pools re-import run.py on platforms that spawn instead of fork, so fall back to a single process there
+    return False if 'win' in sys.platform else True
+
 def get_next_path_index(path, ext_list=None):
     next_idx = 0
 
@@ -50,6 +73,12 @@ def get_next_path_index(path, ext_list=None):
 
     return next_idx
 
+def get_frame_size(height, aspect=16 / 9):
+    """
+    (width, height) of a frame height pixels tall, width rounded to an even number for video encoders
+    """
+    return int(round(height * aspect / 2)) * 2, height
+
 def get_ext(path, include_period=False):
     ext = os.path.splitext(path)[-1].lower()
     return ext if include_period else ext[1:]
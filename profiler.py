@@ -0,0 +1,111 @@
+from contextlib import contextmanager
+import cProfile
+import threading
+import atexit
+import psutil
+import json
+import time
+import sys
+import os
+
+RSS_SAMPLE_INTERVAL = 0.1 # [s] How often memory use is sampled
+
+_counters = {} # Counts of work done by this process, see count
+_stages = [] # Finished stages in the order they started
+_run = {'start': None, 'profile_dir': None, 'peak_rss': 0, 'depth': 0}
+
+def count(name, n=1):
+    """
+    Add n to a named counter, example - count('frames_decoded', len(frame_idxs))
+    """
+    _counters[name] = _counters.get(name, 0) + int(n)
+
+def get_counters():
+    return dict(_counters)
+
+def add_counters(counters):
+    """
+    Add counts made in another process, e.g. a pool worker
+    """
+    for name, n in counters.items():
+        count(name, n)
+
+def get_rss():
+    """
+    Memory [bytes] used by this process & all of its child processes, e.g. pool workers & ffmpeg
+    """
+    proc = psutil.Process()
+    rss = proc.memory_info().rss
+    for child in proc.children(recursive=True):
+        try:
+            rss += child.memory_info().rss
+        except psutil.Error: # Child exited between listing & reading it
+            pass
+    return rss
+
+def _sample_rss():
+    while True:
+        rss = get_rss()
+        _run['peak_rss'] = max(_run['peak_rss'], rss)
+        for record in _stages:
+            if record['wall'] is None: # Still running
+                record['peak_rss'] = max(record['peak_rss'], rss)
+        time.sleep(RSS_SAMPLE_INTERVAL)
+
+def start(report_filename=None, profile_dir=None):
+    """
+    Saves the run report to report_filename when the program exits, memory use is only sampled when a report is asked for.
+        profile_dir - save a cProfile dump of each top level stage here, open with python -m pstats or snakeviz
+    """
+    _run['start'] = time.time()
+    _run['profile_dir'] = profile_dir
+    if profile_dir:
+        os.makedirs(profile_dir, exist_ok=True)
+
+    if report_filename:
+        threading.Thread(target=_sample_rss, daemon=True).start()
+        atexit.register(save_report, report_filename)
+
+@contextmanager
+def stage(name):
+    """
+    Time a pipeline stage: wall time, cpu time of this process & of finished child processes, and peak memory use
+    while it ran. Stages can be nested, only top level stages are profiled.
+    """
+    record = {'name': name, 'depth': _run['depth'], 'wall': None, 'cpu': None, 'children_cpu': None, 'peak_rss': get_rss()}
+    stage_idx = len(_stages)
+    _stages.append(record)
+
+    profiler = None
+    if _run['profile_dir'] and _run['depth'] == 0:
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    children_start = psutil.Process().cpu_times()
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    _run['depth'] += 1
+    try:
+        yield record
+    finally:
+        _run['depth'] -= 1
+        record['cpu'] = time.process_time() - cpu_start
+        children_end = psutil.Process().cpu_times()
+        record['children_cpu'] = (children_end.children_user + children_end.children_system) - (children_start.children_user + children_start.children_system)
+        record['wall'] = time.perf_counter() - wall_start
+
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(os.path.join(_run['profile_dir'], f'{stage_idx:02d}_{name}.prof'))
+
+def get_report():
+    return {'argv': sys.argv,
+            'total_wall': time.time() - _run['start'] if _run['start'] else None,
+            'peak_rss': max([_run['peak_rss']] + [s['peak_rss'] for s in _stages]),
+            'stages': _stages,
+            'counters': get_counters()}
+
+def save_report(filename):
+    with open(filename, 'w') as f:
+        json.dump(get_report(), f, indent=1)
+    print(f'Run report saved to {filename}')
@@ -0,0 +1,240 @@
+from other import get_ext, get_frame_size, multiprocess_supported, FFMPEG_BIN
+from video import cuts_to_clips, get_still, IMG_EXTENSIONS, VIDEO_EXTENSIONS
+from edl import edl_to_cuts
+from moviepy.editor import concatenate_videoclips, AudioFileClip
+import numpy as np
+import cv2
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+import subprocess
+import time
+import tempfile
+import os
+
+RENDER_BACKENDS = ['moviepy', 'ffmpeg']
+RENDER_SIZE = (1920, 1080)
+RENDER_FPS = 30
+STILL_INPUT_FPS = 1 # Images are read at this rate and repeated up to the render fps
+PREVIEW_HEIGHT = 240
+PREVIEW_FPS = 12
+SHEET_THUMB_HEIGHT = 90 # Contact sheet thumbnail height, one thumbnail per cut
+SHEET_COLUMNS = 10
+
+def render_moviepy(cuts, filename, music_file, start_time, stop_time, size=RENDER_SIZE):
+    """
+    Render (path, start_time, duration) cuts with MoviePy, every frame passes through python
+        start_time, stop_time [s] - section of music_file used as the music video's audio
+    """
+    music_video = concatenate_videoclips(cuts_to_clips(cuts, size=size), method='compose')
+
+    music_audio = AudioFileClip(music_file).subclip(start_time, stop_time)
+
+    final_music_video = music_video.set_audio(music_audio)
+
+    fps = music_video.fps
+    if not(fps):
+        fps = RENDER_FPS
+    final_music_video.write_videofile(filename, fps=fps)
+
+def get_cut_frame_counts(cuts, fps):
+    """
+    Number of frames for each cut. Cut ends are rounded to frames on the music video's timeline rather than per cut,
+    so rounding error never builds up and every cut starts on the frame nearest its audio beat.
+    """
+    ends = np.round(np.cumsum([duration for _, _, duration in cuts]) * fps).astype(int)
+    return np.diff(np.concatenate(([0], ends))).tolist()
+
+def get_ffmpeg_inputs(cuts, frame_counts, size=RENDER_SIZE, fps=RENDER_FPS):
+    """
+    ffmpeg input arguments & filter graph lines for cuts. Each cut is trimmed to its frame count,
+    scaled & padded to size and labelled [v0], [v1], ... in order. Cuts shorter than a frame are skipped.
+    Returns (input args, filter lines, labels)
+    """
+    width, height = size
+    inputs = []
+    filters = []
+    labels = []
+    for (path, start_time, duration), frame_cnt in zip(cuts, frame_counts):
+        if frame_cnt <= 0:
+            continue
+
+        input_idx = len(labels)
+        if get_ext(path) in IMG_EXTENSIONS:
+            inputs += ['-loop', '1', '-framerate', str(STILL_INPUT_FPS), '-t', f'{duration:.6f}', '-i', get_still(path, size)]
+        else:
+            inputs += ['-threads', '2', '-ss', f'{start_time:.6f}', '-t', f'{duration:.6f}', '-i', path]
+
+        labels += [f'[v{input_idx}]']
+        filters += [f'[{input_idx}:v]setpts=PTS-STARTPTS,'
+                    f'scale={width}:{height}:force_original_aspect_ratio=decrease,pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,setsar=1,'
+                    f'fps={fps},tpad=stop_mode=clone:stop_duration=1,trim=end_frame={frame_cnt},setpts=PTS-STARTPTS{labels[-1]}']
+
+    return inputs, filters, labels
+
+def encode_cuts(cuts, frame_counts, filename, music_file=None, start_time=0, size=RENDER_SIZE, fps=RENDER_FPS, codec='libx264', preset='medium', crf=18):
+    """
+    Encode cuts in one native ffmpeg process. Every cut is an input trimmed to its frame count, scaled & padded
+    by one filter graph, then concatenated and muxed with the music starting at start_time.
+    """
+    duration = sum(frame_counts) / fps
+
+    inputs, filters, labels = get_ffmpeg_inputs(cuts, frame_counts, size=size, fps=fps)
+    filters += [''.join(labels) + f'concat=n={len(labels)}:v=1:a=0,format=yuv420p[vout]']
+
+    cmd = [FFMPEG_BIN, '-y', '-loglevel', 'error', '-stats'] + inputs
+    maps = ['-map', '[vout]']
+    if music_file:
+        cmd += ['-ss', f'{start_time:.6f}', '-t', f'{duration:.6f}', '-i', music_file]
+        maps += ['-map', f'{len(labels)}:a', '-c:a', 'aac', '-b:a', '320k']
+
+    # Filter graph for hundreds of cuts is too long for a command line, pass it as a file
+    with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as f:
+        f.write(';\n'.join(filters))
+        filter_script = f.name
+
+    try:
+        cmd += ['-filter_complex_script', filter_script] + maps
+        cmd += ['-c:v', codec, '-preset', preset, '-crf', str(crf), '-r', str(fps), '-t', f'{duration:.6f}', filename]
+        subprocess.run(cmd, check=True)
+    finally:
+        os.remove(filter_script)
+
+def split_segments(frame_counts, segments):
+    """
+    Split cut indices in to contiguous groups with about the same number of frames each
+    """
+    ends = np.cumsum(frame_counts)
+    bounds = np.searchsorted(ends, ends[-1] * np.arange(1, segments) / segments) + 1
+    bounds = sorted(set(bounds.tolist()) - {0, len(frame_counts)})
+    return [idxs.tolist() for idxs in np.split(np.arange(len(frame_counts)), bounds)]
+
+def render_ffmpeg(cuts, filename, music_file=None, start_time=0, size=RENDER_SIZE, fps=RENDER_FPS, codec='libx264', preset='medium', crf=18, segments=1, workers=None):
+    """
+    Render (path, start_time, duration) cuts natively with ffmpeg
+        segments - number of parts encoded at the same time, split on cut boundaries. Parts are joined without re-encoding
+            and the music is muxed once
+        workers - parts encoded at the same time, defaults to segments
+    """
+    frame_counts = get_cut_frame_counts(cuts, fps)
+    # Cuts shorter than a frame add nothing, dropped so no segment is left with only empty cuts to encode
+    kept = [k for k, frame_cnt in enumerate(frame_counts) if frame_cnt > 0]
+    cuts, frame_counts = [cuts[k] for k in kept], [frame_counts[k] for k in kept]
+    encode_options = {'size': size, 'fps': fps, 'codec': codec, 'preset': preset, 'crf': crf}
+
+    if segments <= 1 or len(cuts) < 2:
+        encode_cuts(cuts, frame_counts, filename, music_file=music_file, start_time=start_time, **encode_options)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        groups = split_segments(frame_counts, segments)
+        segment_files = [os.path.join(tmp_dir, f'segment{k}.mp4') for k in range(len(groups))]
+
+        def encode_segment(k):
+            idxs = groups[k]
+            encode_cuts([cuts[i] for i in idxs], [frame_counts[i] for i in idxs], segment_files[k], **encode_options)
+
+        # Each worker just waits on its ffmpeg process so threads are enough
+        with ThreadPool(workers if workers else len(groups)) as pool:
+            pool.map(encode_segment, range(len(groups)))
+
+        concat_list = os.path.join(tmp_dir, 'segments.txt')
+        with open(concat_list, 'w') as f:
+            f.writelines(f"file '{os.path.abspath(path)}'\n" for path in segment_files)
+
+        duration = sum(frame_counts) / fps
+        cmd = [FFMPEG_BIN, '-y', '-loglevel', 'error', '-f', 'concat', '-safe', '0', '-i', concat_list]
+        maps = ['-map', '0:v']
+        if music_file:
+            cmd += ['-ss', f'{start_time:.6f}', '-t', f'{duration:.6f}', '-i', music_file]
+            maps += ['-map', '1:a', '-c:a', 'aac', '-b:a', '320k']
+        subprocess.run(cmd + maps + ['-c:v', 'copy', '-t', f'{duration:.6f}', filename], check=True)
+
+def render_edl(edl, filename, backend='moviepy', segments=1, size=RENDER_SIZE, use_proxy=False):
+    """
+    Render an edit decision list made by edl.make_edl with the chosen backend
+        segments - parts encoded in parallel, ffmpeg backend only
+        use_proxy - render a draft from the plan's low resolution proxies
+    """
+    cuts = edl_to_cuts(edl, use_proxy=use_proxy)
+    if backend == 'ffmpeg':
+        render_ffmpeg(cuts, filename, music_file=edl['music_file'], start_time=edl['start_time'], size=size, segments=segments)
+    else:
+        render_moviepy(cuts, filename, edl['music_file'], edl['start_time'], edl['stop_time'], size=size)
+
+def _render_job(job):
+    edl, filename, options = job
+    start = time.time()
+    render_edl(edl, filename, **options)
+    return filename, time.time() - start
+
+def render_edls(edls, filenames, backend='moviepy', workers=1, segments=1, size=RENDER_SIZE, use_proxy=False):
+    """
+    Render many edit decision lists, workers at a time in separate processes. Prints each render as it finishes.
+    """
+    options = {'backend': backend, 'segments': segments, 'size': size, 'use_proxy': use_proxy}
+    jobs = [(edl, filename, options) for edl, filename in zip(edls, filenames)]
+    start = time.time()
+
+    def report(results):
+        for cnt, (filename, elapsed) in enumerate(results):
+            print(f'Complete {cnt + 1} of {len(jobs)}: {filename} rendered in {elapsed / 60:.1f} minutes.')
+
+    if workers == 1 or len(jobs) == 1 or not multiprocess_supported():
+        report(map(_render_job, jobs))
+    else:
+        with Pool(processes=workers, maxtasksperchild=1) as pool: # New process per render, MoviePy holds on to memory
+            report(pool.imap_unordered(_render_job, jobs))
+
+    print(f'Rendered {len(jobs)} music videos in {(time.time() - start) / 60:.1f} minutes.')
+
+def render_preview(edl, filename):
+    """
+    Small, low frame rate, quickly encoded render of an edit decision list to check where cuts land.
+    Cuts from proxies when the plan has them.
+    """
+    cuts = edl_to_cuts(edl, use_proxy=True)
+    render_ffmpeg(cuts, filename, music_file=edl['music_file'], start_time=edl['start_time'], size=get_frame_size(PREVIEW_HEIGHT), fps=PREVIEW_FPS,
+                  preset='ultrafast', crf=35)
+
+def get_cut_thumbnails(cuts, size):
+    """
+    First frame of each (path, start_time, duration) cut scaled to size as RGB arrays. Each video is opened once.
+    """
+    thumbs = [np.zeros((size[1], size[0], 3), dtype=np.uint8) for _ in cuts]
+    by_path = {}
+    for idx, (path, start_time, _) in enumerate(cuts):
+        by_path.setdefault(path, []).append((start_time, idx))
+
+    for path, starts in by_path.items():
+        if get_ext(path) in IMG_EXTENSIONS:
+            frame = cv2.cvtColor(cv2.imread(get_still(path, size)), cv2.COLOR_BGR2RGB)
+            for _, idx in starts:
+                thumbs[idx] = cv2.resize(frame, size)
+        elif get_ext(path) in VIDEO_EXTENSIONS:
+            cap = cv2.VideoCapture(path)
+            for start_time, idx in sorted(starts):
+                cap.set(cv2.CAP_PROP_POS_MSEC, start_time * 1000)
+                ret, frame = cap.read()
+                if ret:
+                    thumbs[idx] = cv2.resize(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB), size, interpolation=cv2.INTER_AREA)
+            cap.release()
+
+    return thumbs
+
+def render_contact_sheet(edl, filename, thumb_height=SHEET_THUMB_HEIGHT, columns=SHEET_COLUMNS):
+    """
+    Save one image with the first frame of every cut, labelled with the time the cut starts in the music video
+    """
+    cuts = edl_to_cuts(edl, use_proxy=True)
+    size = get_frame_size(thumb_height)
+    thumbs = get_cut_thumbnails(cuts, size)
+
+    t = 0
+    for thumb, (_, _, duration) in zip(thumbs, cuts):
+        cv2.putText(thumb, f'{t:.2f}s', (4, size[1] - 6), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (255, 255, 0), 1, cv2.LINE_AA)
+        t += duration
+
+    rows = -(-len(thumbs) // columns)
+    thumbs += [np.zeros_like(thumbs[0])] * (rows * columns - len(thumbs))
+    sheet = np.vstack([np.hstack(thumbs[r * columns:(r + 1) * columns]) for r in range(rows)])
+    cv2.imwrite(filename, cv2.cvtColor(sheet, cv2.COLOR_RGB2BGR))
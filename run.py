@@ -1,11 +1,11 @@
-from audio import get_audio_data, get_saved_audio, get_split_times, is_increasing, separate_audio_tracks, SEPARATE_DICT
-from video import build_musicvideo_clips, export_clips, VIDEO_EXTENSIONS, IMG_EXTENSIONS
-from other import get_unique_filename, add_dirs_if_not_exists, get_default_files
-from moviepy.editor import VideoFileClip, concatenate_videoclips, AudioFileClip
+from audio import get_audio_data, get_saved_audio, get_saved_bucket_spectra, get_split_times, get_saved_onset_envelope, get_onset_split_times, is_increasing, separate_audio_tracks, SEPARATE_DICT, DETECTORS
+from video import plan_musicvideo_cuts, index_videos, export_clips, update_clip_manifest, get_manifest_split_times, make_proxies, VIDEO_EXTENSIONS, IMG_EXTENSIONS, SCAN_MODES, MATCH_MODES, PROXY_HEIGHT
+from other import get_unique_filename, get_unique_filenames, add_dirs_if_not_exists, get_default_files, get_frame_size
+from render import render_edl, render_edls, render_preview, render_contact_sheet, RENDER_BACKENDS
+from edl import make_edl, save_edl, load_edl
+from profiler import stage, start as start_profiler
 from decord import VideoReader
 from decord import cpu, gpu
-import wave
-import pyaudio
 from tqdm import tqdm
 import numpy as np
 import sys
@@ -33,7 +33,23 @@ START_TIME = 0
 STOP_TIME = 0
 args = sys.argv
 INSTRUMENT = 'drums.wav'
-HEIGHT = 1080
+HEIGHT = None # Music video height, 1080 or PROXY_HEIGHT with -proxy
+WORKERS = 1 # Processes used to scan videos for scene changes
+EXPORT_WORKERS = 1 # Music videos rendered at the same time
+SEED = None # Random seed of the first shuffled music video, each following video uses the next seed
+SCAN_MODE = 'auto'
+RENDER_BACKEND = 'moviepy'
+RENDER_SEGMENTS = 1 # Parts of each music video encoded in parallel (ffmpeg backend)
+MATCH = 'sequential' # How clips are matched to audio cuts
+PLAN_FILENAME = None # Save edit decision lists here instead of rendering
+LOAD_PLAN_FILENAME = None # Render this edit decision list, skipping all analysis
+REPORT_FILENAME = None # Save stage timings, counters & peak memory use to this json file
+PROFILE_DIR = None # Save a cProfile dump of each stage in this directory
+DETECTOR = 'threshold' # How audio split times are found
+SENSITIVITY = 1.5 # Onset detector peak height, higher for fewer cuts
+USE_PROXY = False # Scan & render low resolution copies of the videos
+PREVIEW = False # Quick low quality render instead of the full music video
+CONTACT_SHEET = False # Image of every cut instead of the music video
 
 i = 0
 while True:
@@ -76,6 +92,55 @@ while True:
         EXPORT_CLIPS = True
     elif args[i] == '-use_clip_dir':
         USE_CLIP_DIR = True
+    elif args[i] == '-workers':
+        i += 1
+        WORKERS = int(args[i])
+    elif args[i] == '-export_workers':
+        i += 1
+        EXPORT_WORKERS = int(args[i])
+    elif args[i] == '-seed':
+        i += 1
+        SEED = int(args[i])
+    elif args[i] == '-scan_mode':
+        i += 1
+        SCAN_MODE = str(args[i])
+        assert SCAN_MODE in SCAN_MODES, f'-scan_mode must be one of {SCAN_MODES}'
+    elif args[i] == '-render':
+        i += 1
+        RENDER_BACKEND = str(args[i])
+        assert RENDER_BACKEND in RENDER_BACKENDS, f'-render must be one of {RENDER_BACKENDS}'
+    elif args[i] == '-segments':
+        i += 1
+        RENDER_SEGMENTS = int(args[i])
+    elif args[i] == '-match':
+        i += 1
+        MATCH = str(args[i])
+        assert MATCH in MATCH_MODES, f'-match must be one of {MATCH_MODES}'
+    elif args[i] == '-plan':
+        i += 1
+        PLAN_FILENAME = str(args[i])
+    elif args[i] == '-load_plan':
+        i += 1
+        LOAD_PLAN_FILENAME = str(args[i])
+    elif args[i] == '-detector':
+        i += 1
+        DETECTOR = str(args[i])
+        assert DETECTOR in DETECTORS, f'-detector must be one of {DETECTORS}'
+    elif args[i] == '-sensitivity':
+        i += 1
+        SENSITIVITY = float(args[i])
+    elif args[i] == '-proxy':
+        USE_PROXY = True
+    elif args[i] == '-preview':
+        PREVIEW = True
+    elif args[i] == '-contact_sheet':
+        CONTACT_SHEET = True
+    elif args[i] == '-report':
+        i += 1
+        REPORT_FILENAME = str(args[i])
+    elif args[i] == '-profile_dir':
+        i += 1
+        PROFILE_DIR = str(args[i])
     elif args[i] == '-use_once': # Use each clip only once
         USE_ONCE = True
     elif i != 0:
@@ -85,7 +150,39 @@ while True:
     i += 1
     if i >= len(args):
         break
-        
+
+start_profiler(report_filename=REPORT_FILENAME, profile_dir=PROFILE_DIR)
+
+if not HEIGHT:
+    HEIGHT = PROXY_HEIGHT if USE_PROXY else 1080
+RENDER_SIZE = get_frame_size(HEIGHT)
+RENDER_PROXY = USE_PROXY and HEIGHT <= PROXY_HEIGHT # Proxies are never scaled up, taller music videos render from the sources
+if USE_PROXY and not RENDER_PROXY:
+    print(f'-height {HEIGHT} is taller than the {PROXY_HEIGHT}p proxies, rendering from the source videos.')
+
+def render_drafts(edls, mv_names):
+    """
+    -preview & -contact_sheet renders, returns False if neither was asked for
+    """
+    for edl, mv_name in zip(edls, mv_names):
+        if PREVIEW:
+            print(f'Rendering preview {mv_name}...')
+            render_preview(edl, mv_name)
+        if CONTACT_SHEET:
+            sheet_name = os.path.splitext(mv_name)[0] + '.jpg'
+            print(f'Saving contact sheet {sheet_name}...')
+            render_contact_sheet(edl, sheet_name)
+    return PREVIEW or CONTACT_SHEET
+
+if LOAD_PLAN_FILENAME:
+    mv_name = get_unique_filename(EXPORT_FILENAME)
+    edl = load_edl(LOAD_PLAN_FILENAME)
+    with stage('render'):
+        if not render_drafts([edl], [mv_name]):
+            print(f'Rendering plan {LOAD_PLAN_FILENAME} to {mv_name}...')
+            render_edl(edl, mv_name, backend=RENDER_BACKEND, segments=RENDER_SEGMENTS, size=RENDER_SIZE, use_proxy=RENDER_PROXY)
+    exit(0)
+
 if not MUSIC_FILE:
     print('No song provided by user. For user specified song use -m command argument.')
     files = get_default_files(os.path.join('Media', 'Audio'), ('.mp3', '.wav'))
@@ -107,42 +204,60 @@ VIDEO_FILES = [os.path.join(VID_DIR, f) for f in os.listdir(VID_DIR) if f.split(
 assert len(VIDEO_FILES) > 0, f'No videos found in video directory {VID_DIR}'
 
 if EXPORT_CLIPS:
-    export_clips(VIDEO_FILES, clip_dir=CLIP_DIR)
+    with stage('export_clips'):
+        export_clips(VIDEO_FILES, clip_dir=CLIP_DIR, workers=WORKERS, scan_mode=SCAN_MODE)
     exit(0)
 
-if not SEPARATED_AUDIO_FILE:
-    save_dir = separate_audio_tracks(MUSIC_FILE)
+if DETECTOR == 'threshold' and not SEPARATED_AUDIO_FILE:
+    with stage('separate_audio'):
+        save_dir = separate_audio_tracks(MUSIC_FILE, stems=[INSTRUMENT]) # Only the stem used for split times is written
     SEPARATED_AUDIO_FILE = os.path.join(save_dir, INSTRUMENT)
 
 # Verify audio files exist
-assert os.path.exists(SEPARATED_AUDIO_FILE), f'Audio file {SEPARATED_AUDIO_FILE} not found.'
+if DETECTOR == 'threshold':
+    assert os.path.exists(SEPARATED_AUDIO_FILE), f'Audio file {SEPARATED_AUDIO_FILE} not found.'
 assert os.path.exists(MUSIC_FILE), f'Audio file {MUSIC_FILE} not found.'
 
 print('Video Directory: ', VID_DIR)
-print('Reference Audio File: ', SEPARATED_AUDIO_FILE)
+print('Reference Audio File: ', SEPARATED_AUDIO_FILE if DETECTOR == 'threshold' else MUSIC_FILE)
 print('Song Used in Final Music Video: ', MUSIC_FILE)
 print('Export Filename: ', EXPORT_FILENAME)
 
 start_timer = time.time()
 
-saved_data = get_saved_audio(SEPARATED_AUDIO_FILE)
-if saved_data:
-    audio_data, CHUNK, RATE = saved_data
+if DETECTOR == 'onset':
+    # Onsets straight from the full song, no separation or saved thresholds needed
+    CHUNK = 1024
+    with stage('load_audio'):
+        onset_envelope, RATE = get_saved_onset_envelope(MUSIC_FILE, chunk=CHUNK)
+
+    STOP_TIME = len(onset_envelope)*(CHUNK/RATE) if STOP_TIME == 0 else STOP_TIME
+    print(f'Audio to be processed between {START_TIME}s & {STOP_TIME}s')
+    print('Getting split times from song onsets...')
+    with stage('split_times'):
+        audio_split_times = get_onset_split_times(onset_envelope, RATE, chunk=CHUNK, sensitivity=SENSITIVITY, start_time=START_TIME, stop_time=STOP_TIME)
 else:
-    audio_data, CHUNK, RATE = get_audio_data(SEPARATED_AUDIO_FILE)
-
-# Import saved audio amplitude threshold data
-thresh_path = os.path.join(os.path.dirname(SEPARATED_AUDIO_FILE), SAVED_THRESH_FILENAME)
-saved_thresholds = pickle.load(open(thresh_path, "rb"))
-audio_thresholds = saved_thresholds['thresholds']
-freq_buckets = saved_thresholds['buckets']
-freq_buckets_min = saved_thresholds['min_buckets']
-freq_buckets_max = saved_thresholds['max_buckets']
-
-STOP_TIME = len(audio_data)*(CHUNK/RATE) if STOP_TIME == 0 else STOP_TIME
-print(f'Audio to be processed between {START_TIME}s & {STOP_TIME}s')
-print('Getting split times from audio file...')
-audio_split_times = get_split_times(audio_data, RATE, audio_thresholds, freq_buckets, freq_buckets_min, freq_buckets_max, chunk=CHUNK, start_time=START_TIME, stop_time=STOP_TIME)
+    with stage('load_audio'):
+        saved_data = get_saved_audio(SEPARATED_AUDIO_FILE)
+        if saved_data:
+            audio_data, CHUNK, RATE = saved_data
+        else:
+            audio_data, CHUNK, RATE = get_audio_data(SEPARATED_AUDIO_FILE)
+
+    # Import saved audio amplitude threshold data
+    thresh_path = os.path.join(os.path.dirname(SEPARATED_AUDIO_FILE), SAVED_THRESH_FILENAME)
+    saved_thresholds = pickle.load(open(thresh_path, "rb"))
+    audio_thresholds = saved_thresholds['thresholds']
+    freq_buckets = saved_thresholds['buckets']
+    freq_buckets_min = saved_thresholds['min_buckets']
+    freq_buckets_max = saved_thresholds['max_buckets']
+
+    STOP_TIME = len(audio_data)*(CHUNK/RATE) if STOP_TIME == 0 else STOP_TIME
+    print(f'Audio to be processed between {START_TIME}s & {STOP_TIME}s')
+    print('Getting split times from audio file...')
+    with stage('split_times'):
+        spectra = get_saved_bucket_spectra(SEPARATED_AUDIO_FILE, audio_data, freq_buckets, RATE)
+        audio_split_times = get_split_times(audio_data, RATE, audio_thresholds, freq_buckets, freq_buckets_min, freq_buckets_max, chunk=CHUNK, start_time=START_TIME, stop_time=STOP_TIME, spectra=spectra)
 print(f'{len(audio_split_times)} audio slices created.')
 
 print('Building music video. This will take a long time...')
@@ -154,30 +269,58 @@ if SHUFFLE_CNT == 0:
 else:
     print(f'{SHUFFLE_CNT} music videos to be created with same clips shuffled on each iteration.')
 
+known_split_times = {}
 if USE_CLIP_DIR:
     VIDEO_FILES = [os.path.join(CLIP_DIR, d) for d in os.listdir(CLIP_DIR) if d.split('.')[-1] in VIDEO_EXTENSIONS + IMG_EXTENSIONS]
+    print('Updating clip directory manifest...')
+    with stage('clip_manifest'):
+        known_split_times = get_manifest_split_times(CLIP_DIR, update_clip_manifest(CLIP_DIR)) # Clips are single scenes, no scanning needed
 
-for export_cnt in range(SHUFFLE_CNT):
-    mv_clips = build_musicvideo_clips(VIDEO_FILES, audio_split_times, shuffle=shuffle, chunk_size=CHUNK_SIZE, video_height=HEIGHT)
-    assert len(mv_clips) > 0, "Error no clips created. Clip lens may be too short for audio splice times."
+proxies = None
+SCAN_FILES = VIDEO_FILES
+if USE_PROXY:
+    print(f'Making {PROXY_HEIGHT}p proxies of videos...')
+    with stage('proxies'):
+        proxies = make_proxies(VIDEO_FILES, workers=WORKERS)
+    sources = {proxy: path for path, proxy in proxies.items()}
+    SCAN_FILES = [proxies[f] for f in VIDEO_FILES] # Same timeline as the sources, much faster to decode
+    known_split_times = {proxies[f]: times for f, times in known_split_times.items()}
 
-    print(f'Build complete. Cut {len(mv_clips)} clips to match audio slices. Exporting video...')
-    music_video = concatenate_videoclips(mv_clips, method='compose')
-    #del mv_clips
+print('Scanning videos for scene changes...')
+with stage('index_videos'):
+    index_videos([f for f in SCAN_FILES if f not in known_split_times], workers=WORKERS, scan_mode=SCAN_MODE) # Every video decoded once, planning below only reads the index
+
+seed = SEED if SEED is not None else np.random.randint(2**31 - SHUFFLE_CNT)
+
+edls = []
+for export_cnt in range(SHUFFLE_CNT):
+    if shuffle:
+        np.random.seed(seed + export_cnt)
 
-    STOP_TIME = audio_split_times[-1] if music_video.duration < STOP_TIME or STOP_TIME == 0 else STOP_TIME
-    music_audio = AudioFileClip(MUSIC_FILE).subclip(START_TIME, STOP_TIME)
+    with stage('plan'):
+        cuts = plan_musicvideo_cuts(SCAN_FILES, audio_split_times, shuffle=shuffle, use_once=USE_ONCE, chunk_size=CHUNK_SIZE, scan_mode=SCAN_MODE, match=MATCH, known_split_times=known_split_times)
+    assert len(cuts) > 0, "Error no clips created. Clip lens may be too short for audio splice times."
+    if USE_PROXY:
+        cuts = [(sources[path], start, duration) for path, start, duration in cuts] # Plans always point at the full resolution sources
 
-    final_music_video = music_video.set_audio(music_audio)
+    edl = make_edl(cuts, audio_split_times, MUSIC_FILE, start_time=START_TIME, proxies=proxies)
+    if shuffle:
+        edl['seed'] = seed + export_cnt
 
-    mv_name = get_unique_filename(EXPORT_FILENAME) # Appends unique index to export name
+    if PLAN_FILENAME:
+        plan_name = get_unique_filename(PLAN_FILENAME)
+        save_edl(edl, plan_name)
+        print(f'Plan complete. Cut {len(cuts)} clips to match audio slices. Saved to {plan_name}, render with -load_plan {plan_name}')
+        continue
 
-    print(f'Exporting music video file {mv_name}...')
-    fps = music_video.fps
-    if not(fps):
-        fps = 30
-    final_music_video.write_videofile(mv_name, fps=fps)
+    print(f'Plan {export_cnt + 1} of {SHUFFLE_CNT} complete. Cut {len(cuts)} clips to match audio slices.')
+    edls += [edl]
 
-    print(f'Complete {export_cnt + 1} of {SHUFFLE_CNT} complete.')
+if len(edls) > 0:
+    mv_names = get_unique_filenames(EXPORT_FILENAME, len(edls)) # Appends unique index to export names
+    with stage('render'):
+        if not render_drafts(edls, mv_names):
+            print(f'Exporting music video files {", ".join(mv_names)}...')
+            render_edls(edls, mv_names, backend=RENDER_BACKEND, workers=EXPORT_WORKERS, segments=RENDER_SEGMENTS, size=RENDER_SIZE, use_proxy=RENDER_PROXY)
 
 print('Done. Total processing time took {} minutes.'.format((time.time() - start_timer)/60))
\ No newline at end of file
@@ -1,9 +1,7 @@
-from audio import open_stream, get_audio_data, get_saved_audio, fft_to_buckets, get_minmax_bucket_freq, separate_audio_tracks, SEPARATE_DICT
+from audio import play_audio_data, get_audio_data, get_saved_audio, get_saved_bucket_spectra, get_minmax_bucket_freq, suggest_thresholds, separate_audio_tracks, SEPARATE_DICT
 from other import get_default_files
 import os
 import numpy as np
-import pygame
-from pygame import Color, surfarray
 import pickle
 import sys
 
@@ -12,6 +10,9 @@ SEPARATED_AUDIO_FILE = None
 SAVE_FILE = 'saved_thresholds.pkl'
 TEST_THRESHOLDS = False
 INSTRUMENT = 'drums.wav'
+AUTO = False
+CUTS_PER_MIN = 60
+QUANTILE = None
 
 i = 0
 args = sys.argv
@@ -25,6 +26,14 @@ while True:
     elif args[i] == '-instrument':
         i += 1
         INSTRUMENT = SEPARATE_DICT[int(args[i])]
+    elif args[i] == '-auto':
+        AUTO = True
+    elif args[i] == '-cuts_per_min':
+        i += 1
+        CUTS_PER_MIN = float(args[i])
+    elif args[i] == '-quantile':
+        i += 1
+        QUANTILE = float(args[i])
     elif i != 0:
         print(f'Command argument {args[i]} not recognized.')
         exit(0)
@@ -48,7 +57,7 @@ if not MUSIC_FILE:
         exit(0)
 
 if not SEPARATED_AUDIO_FILE:
-    save_dir = separate_audio_tracks(MUSIC_FILE)
+    save_dir = separate_audio_tracks(MUSIC_FILE, stems=[INSTRUMENT]) # Only the stem used for split times is written
     SEPARATED_AUDIO_FILE = os.path.join(save_dir, INSTRUMENT)
 
 if not(os.path.exists(SEPARATED_AUDIO_FILE)):
@@ -59,6 +68,7 @@ SCREEN_WIDTH = 800
 SCREEN_HEIGHT = 800
 
 cell_size = 10 # Number of pixels per cell
+FPS = 60 # Display refresh rate, independent of audio playback
 
 cell_width = SCREEN_WIDTH//cell_size
 cell_height = SCREEN_HEIGHT//cell_size
@@ -74,8 +84,29 @@ else:
 
 buckets = [31.25 * 2 ** (n) for n in range(10)]
 
+spectra = get_saved_bucket_spectra(SEPARATED_AUDIO_FILE, audio_data, buckets, RATE) # Frequency buckets for every CHUNK, computed once up front
+
+min_bucket, max_bucket = get_minmax_bucket_freq(audio_data, buckets, RATE, spectra=spectra)
 
-min_bucket, max_bucket = get_minmax_bucket_freq(audio_data, buckets, RATE)
+def save_thresholds(thresh):
+    save_dir = os.path.dirname(SEPARATED_AUDIO_FILE)
+
+    # Save audio thresholds to pickle file
+    pickle.dump({'thresholds': thresh,
+                 'buckets': buckets,
+                 'min_buckets': min_bucket,
+                 'max_buckets': max_bucket,
+                 'audio_file': os.path.basename(SEPARATED_AUDIO_FILE)}, open(os.path.join(save_dir, SAVE_FILE), "wb"))
+
+if AUTO:
+    # Headless, no audio device or display needed
+    thresh = suggest_thresholds(spectra, min_bucket, max_bucket, RATE, chunk=CHUNK, cuts_per_min=CUTS_PER_MIN, quantile=QUANTILE)
+    save_thresholds(thresh)
+    print(f'Thresholds saved to {os.path.join(os.path.dirname(SEPARATED_AUDIO_FILE), SAVE_FILE)}: {thresh}')
+    exit(0)
+
+import pygame # Only needed for the interactive tool
+from pygame import Color, surfarray
 
 
 def new_state(freq_buckets, min_bucket, max_bucket):
@@ -119,24 +150,22 @@ def state_to_px(state, px, thresh, buckets):
     return px
 
 
-stream, wf, CHUNK = open_stream(SEPARATED_AUDIO_FILE)
-
 # Initialize display state
 state = np.zeros((cell_height, cell_width))
 pygame.init()
 screen = pygame.display.set_mode((display_height, display_width))
 pygame.display.set_caption('Threshold Helper')
+clock = pygame.time.Clock()
 
-# create a surface with the size as the array
+# Pixel array drawn at cell size=1, scaled up on to the screen once per frame
 surface = pygame.Surface((cell_height, cell_width))
-surface = pygame.transform.scale(surface, (display_height, display_width))  # Scale Size Up
+px = np.ones((cell_height, cell_width, 3), dtype=np.uint8) * 255
 
-# Initialize screen to white
-px = pygame.surfarray.pixels3d(surface)
-px[:, :, :] = np.ones((display_height, display_width, 3)) * 255
+# Audio plays from its own thread, the display follows whatever chunk is currently being heard
+stream, cursor = play_audio_data(SEPARATED_AUDIO_FILE, audio_data)
+latency_frames = int(stream.get_output_latency() * RATE)
 
 run = True
-cnt = 0
 thresh = {i: 0 for i in range(len(buckets))}
 while run:
     for event in pygame.event.get():
@@ -161,20 +190,11 @@ while run:
         if event.type == pygame.QUIT:
             run = False
 
-    # Scale Screen Size Down to edit pixel array at cell size=1 --------------------------------------------------
-    surface = pygame.transform.scale(surface, (cell_height, cell_width))
-    px = pygame.surfarray.pixels3d(surface)
-
-    data = audio_data[cnt]
-
-    stream.write(bytes(data))
+    if not stream.is_active(): # Song finished
+        run = False
 
-    n = len(data)
-    fhat = np.fft.fft(data, n)
-    PSD = np.abs(fhat * np.conj(fhat) / n)  # Power Spectral Density
-    freq = (RATE / n) * np.arange(n)
-
-    fb, idxs = fft_to_buckets(freq, PSD, buckets)  # Chunk frequencies in to buckets
+    cnt = min(max(cursor[0] - latency_frames, 0) // CHUNK, len(spectra) - 1)
+    fb = spectra[cnt]
 
     # Iterate State
     if TEST_THRESHOLDS:
@@ -184,22 +204,15 @@ while run:
         state = new_state(fb, min_bucket, max_bucket)
     px = state_to_px(state, px, thresh, fb)
 
-    # Scale Screen Size Up to display pixel array at cell size=multiplier ----------------------------------------
-    surface = pygame.transform.scale(surface, (display_height, display_width))  # Scale Size Up
-    screen.blit(surface, (0, 0))  # Update all pixels on screen object
+    # Scale pixel array up to display at cell size=multiplier ----------------------------------------------------
+    surfarray.blit_array(surface, px)
+    pygame.transform.scale(surface, (display_height, display_width), screen)
 
     pygame.display.update()
+    clock.tick(FPS)
 
-    cnt += 1
-
+stream.stop_stream()
+stream.close()
 pygame.quit()
 
-save_dir = os.path.join(save_dir, *SEPARATED_AUDIO_FILE.split('\\')[:-1])
-#save_dir = '\\'.join(SEPARATED_AUDIO_FILE.split('\\')[:-1])
-
-# Save audio thresholds to pickle file
-pickle.dump({'thresholds': thresh,
-             'buckets': buckets,
-             'min_buckets': min_bucket,
-             'max_buckets': max_bucket,
-             'audio_file': SEPARATED_AUDIO_FILE.split('\\')[-1]}, open(os.path.join(save_dir, SAVE_FILE), "wb"))
+save_thresholds(thresh)
@@ -1,11 +1,18 @@
-from other import get_next_path_index, get_ext, shuffle_in_chunks
+from other import get_next_path_index, get_ext, get_frame_size, shuffle_in_chunks, multiprocess_supported, FFMPEG_BIN
+from profiler import count, get_counters, add_counters
+from cache import get_file_hash, make_key, load_array, save_array, get_cached_path, store_file
 from moviepy.editor import VideoFileClip, ImageClip
 from decord import VideoReader
 from decord import cpu, gpu
 import cv2
 import numpy as np
 from tqdm import tqdm
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+import bisect
 import os
+import json
+import subprocess
 import psutil
 import PIL.Image
 PIL.Image.MAX_IMAGE_PIXELS = 933120000
@@ -13,6 +20,16 @@ PIL.Image.MAX_IMAGE_PIXELS = 933120000
 VIDEO_EXTENSIONS = ['mp4', 'avi', 'mkv', 'm4v', 'mov']
 IMG_EXTENSIONS = ['jpg', 'jpeg'] #, 'png', 'bmp', 'gif', 'tif'
 
+SCAN_SIZE = (320, 180) # (width, height) decord decodes frames at when scanning for scene changes
+SCAN_BATCH_SIZE = 32 # Frames decoded per decord get_batch call when scanning
+SCAN_MODES = ['auto', 'random', 'sequential', 'keyframe']
+MATCH_MODES = ['sequential', 'pool', 'global']
+CLIP_MANIFEST_FILENAME = 'manifest.json'
+STILL_QUALITY = 95 # JPEG quality of images prepared at render size
+PROXY_HEIGHT = 360 # Height of low resolution copies used for scene detection & draft renders
+
+_frame_index_memo = {} # get_frame_index results already loaded by this process
+
 def scene_changed(prev_frame, frame, delta_thresh=10):
     delta = abs(np.mean(prev_frame) - np.mean(frame))
 
@@ -28,89 +45,390 @@ def validate_video(vr):
         valid = False
     return valid
 
-def get_video_split_times(vid_filename, check_freq=1, split_thresh=10, mode='cpu'):
+def choose_scan_mode(key_idxs, frame_cnt, frame_freq):
     """
-    check_freq [seconds] - how often to compare two frames for scene change
-    split_thresh - mean difference in pixel values allowed before triggering split
+    Random access decodes from the previous keyframe up to each sample, about half a GOP per sample.
+    Sequential access decodes every frame, frame_freq frames per sample. Pick whichever decodes less.
     """
-    ctx = gpu(0) if mode == 'gpu' else cpu(0)
+    gop_len = frame_cnt / max(len(key_idxs), 1)
+    return 'sequential' if frame_freq <= gop_len / 2 else 'random'
 
-    vr = VideoReader(vid_filename, ctx=ctx)
+def get_keyframe_samples(key_idxs, frame_freq):
+    """
+    Keyframe indices at least frame_freq frames apart
+    """
+    samples = []
+    for i in key_idxs:
+        if len(samples) == 0 or i - samples[-1] >= frame_freq:
+            samples += [i]
+    return np.array(samples, dtype=int)
 
-    frame_cnt = len(vr)
-    fps = vr.get_avg_fps()
+def get_frame_means_ffmpeg(vid_filename, check_freq=1, scan_size=SCAN_SIZE):
+    """
+    get_frame_means for videos decord can't read. ffmpeg drops to one frame every check_freq seconds & scales it down,
+    then pipes the raw rgb frames in to one reused buffer.
+    """
+    width, height = scan_size if scan_size else SCAN_SIZE
+    cmd = [FFMPEG_BIN, '-loglevel', 'error', '-i', vid_filename, '-an',
+           '-vf', f'fps=1/{check_freq},scale={width}:{height}', '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-']
 
-    if not validate_video(vr):
-        vr = VideoFileClip(vid_filename)
-        moviepy_iterator = enumerate(vr.iter_frames())
+    frame = np.empty((height, width, 3), dtype=np.uint8)
+    frame_buffer = memoryview(frame).cast('B')
 
-    start_time = 0  # time in seconds from video where current clip starts
+    means = []
+    count('videos_opened')
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+    while proc.stdout.readinto(frame_buffer) == len(frame_buffer):
+        means += [frame.mean()]
+    proc.stdout.close()
+    count('frames_decoded', len(means))
 
-    frame_freq = int(fps * check_freq)
+    if proc.wait() != 0 and len(means) == 0:
+        raise IOError(f'ffmpeg could not read {vid_filename}')
 
-    times = []
-    idx = 0
-    for i in range(0, frame_cnt, frame_freq):
-        if 'VideoReader' in str(type(vr)): # Decord
-            frame = vr[i].asnumpy()
-        else: # Moviepy (Slower)
-            while i >= idx:
-                idx, frame = next(moviepy_iterator)
+    return np.array(means), np.arange(len(means)) * float(check_freq)
 
-        if i > 0:  # Skip first frame
-            if start_time != stop_time and scene_changed(prev_frame, frame, delta_thresh=split_thresh):
-                times += [(start_time, stop_time)]
+def get_frame_means(vid_filename, check_freq=1, mode='cpu', scan_size=SCAN_SIZE, batch_size=SCAN_BATCH_SIZE, scan_mode='auto'):
+    """
+    Mean pixel value of one frame every check_freq seconds. Returns (means, times) arrays, times in seconds
+    Videos decord can't read are sampled by get_frame_means_ffmpeg.
+        scan_size - (width, height) decord decodes frames at, None for full resolution
+        batch_size - frames requested per decord get_batch call, 0 requests one frame at a time
+        scan_mode - how decord reaches each sampled frame
+            random: seek to each sample
+            sequential: decode straight through the video, skipping frames between samples
+            keyframe: only sample keyframes at least check_freq apart, no other frames are decoded
+            auto: random or sequential, whichever decodes fewer frames for this video's keyframe spacing
+    """
+    assert scan_mode in SCAN_MODES, f'Unknown scan mode {scan_mode}. Use one of {SCAN_MODES}'
+    ctx = gpu(0) if mode == 'gpu' else cpu(0)
+    width, height = scan_size if scan_size else (-1, -1)
 
-                start_time = i/fps
+    try:
+        vr = VideoReader(vid_filename, ctx=ctx, width=width, height=height)
+        count('videos_opened')
+    except Exception:
+        return get_frame_means_ffmpeg(vid_filename, check_freq=check_freq, scan_size=scan_size)
 
-        prev_frame = frame
-        stop_time = i/fps
+    if not validate_video(vr):
+        return get_frame_means_ffmpeg(vid_filename, check_freq=check_freq, scan_size=scan_size)
 
-    if len(times) == 0:
-        times += [(0, stop_time)]
+    frame_cnt = len(vr)
+    fps = vr.get_avg_fps()
 
-    return times
+    frame_freq = int(fps * check_freq)
+    frame_idxs = np.arange(0, frame_cnt, frame_freq)
+
+    if scan_mode != 'random':
+        key_idxs = vr.get_key_indices()
+        if scan_mode == 'auto':
+            scan_mode = choose_scan_mode(key_idxs, frame_cnt, frame_freq)
+        elif scan_mode == 'keyframe' and len(key_idxs) > 0:
+            frame_idxs = get_keyframe_samples(key_idxs, frame_freq)
+
+    means = np.empty(len(frame_idxs))
+    if scan_mode == 'sequential': # No seeking
+        count('frames_decoded', frame_idxs[-1] + 1 if len(frame_idxs) else 0)
+        vr.seek(0)
+        for k in range(len(frame_idxs)):
+            means[k] = vr.next().asnumpy().mean()
+            if k < len(frame_idxs) - 1:
+                vr.skip_frames(frame_freq - 1) # Skipped frames are decoded but not converted or copied
+        return means, frame_idxs / fps
+
+    count('frames_decoded', len(frame_idxs)) # Sampled frames, frames decoded to reach them are not counted
+    if batch_size: # Many frames per call
+        for b in range(0, len(frame_idxs), batch_size):
+            batch = vr.get_batch(frame_idxs[b:b + batch_size].tolist()).asnumpy()
+            means[b:b + batch_size] = batch.reshape(len(batch), -1).mean(axis=1)
+        return means, frame_idxs / fps
+
+    for k, i in enumerate(frame_idxs):
+        means[k] = np.mean(vr[int(i)].asnumpy())
+
+    return means, frame_idxs / fps
+
+def get_frame_index(vid_filename, check_freq=1, mode='cpu', scan_mode='auto'):
+    """
+    get_frame_means saved to disk per video, keyed by the file's content hash, modified time & check_freq.
+    Lets any split threshold be tried again without decoding the video.
+    """
+    # Random, sequential & auto modes sample the same frames, keyframe mode samples different ones
+    key = make_key('frame_means', get_file_hash(vid_filename), os.stat(vid_filename).st_mtime_ns, check_freq, SCAN_SIZE, scan_mode == 'keyframe')
+    if key not in _frame_index_memo:
+        index = load_array(key, mmap=False)
+        if index is None:
+            index = np.vstack(get_frame_means(vid_filename, check_freq=check_freq, mode=mode, scan_mode=scan_mode))
+            save_array(key, index)
+        _frame_index_memo[key] = index
+
+    means, times = _frame_index_memo[key]
+    return means, times
+
+def split_times_from_means(means, times, split_thresh=10):
+    """
+    Clip (start, stop) times from sampled frame means. Same result as comparing each sample with the previous one
+    using scene_changed, without a python loop.
+        split_thresh - mean difference in pixel values allowed before triggering split
+    """
+    # Sample 0 counts as a split. A sample directly after a split can't split again (clip would have no length),
+    # so within a run of consecutive scene changes only every other sample splits.
+    changed = np.concatenate(([True], np.abs(np.diff(means)) > split_thresh))
+    sample_idxs = np.arange(len(changed))
+    run_starts = changed & ~np.concatenate(([False], changed[:-1]))
+    run_start_idxs = np.maximum.accumulate(np.where(run_starts, sample_idxs, 0))
+    splits = changed & ((sample_idxs - run_start_idxs) % 2 == 0)
+    splits[0] = False
+
+    split_idxs = np.flatnonzero(splits)
+    if len(split_idxs) == 0:
+        return [(0, times[-1].item())]
+
+    starts = [0] + times[split_idxs[:-1]].tolist()
+    stops = times[split_idxs - 1].tolist()
+    return list(zip(starts, stops))
+
+def get_video_split_times(vid_filename, check_freq=1, split_thresh=10, mode='cpu', scan_mode='auto'):
+    """
+    check_freq [seconds] - how often to compare two frames for scene change
+    split_thresh - mean difference in pixel values allowed before triggering split
+    scan_mode - how frames are sampled, see get_frame_means
+    """
+    means, times = get_frame_index(vid_filename, check_freq=check_freq, mode=mode, scan_mode=scan_mode)
+    return split_times_from_means(means, times, split_thresh=split_thresh)
+
+def _scan_video(job):
+    path, check_freq, split_thresh, scan_mode = job
+    try:
+        return path, get_video_split_times(path, check_freq=check_freq, split_thresh=split_thresh, scan_mode=scan_mode)
+    except Exception as e:
+        print(f'Failed to find split times for {path}: {e}')
+        return path, []
+
+def _scan_video_counted(job):
+    # Counts made in a pool worker are sent back with the result
+    before = get_counters()
+    result = _scan_video(job)
+    return result, {name: n - before.get(name, 0) for name, n in get_counters().items()}
+
+def scan_videos(video_path_list, check_freq=1, split_thresh=5, workers=None, ordered=True, videos_per_worker=10, scan_mode='auto'):
+    """
+    Find split times for many videos concurrently in a pool of processes. Yields (path, split_times)
+        workers - number of processes, defaults to the number of cpus. 1 scans in this process
+        ordered - yield in video_path_list order if True else in the order videos finish
+        videos_per_worker - videos scanned before a worker process is replaced, bounds memory held by each worker
+    Videos that fail to open yield an empty list of split times.
+    """
+    jobs = [(path, check_freq, split_thresh, scan_mode) for path in video_path_list]
+
+    if workers == 1 or not multiprocess_supported():
+        for job in jobs:
+            yield _scan_video(job)
+        return
+
+    with Pool(processes=workers, maxtasksperchild=videos_per_worker) as pool:
+        results = pool.imap(_scan_video_counted, jobs) if ordered else pool.imap_unordered(_scan_video_counted, jobs)
+        for (path, split_times), counters in results:
+            add_counters(counters)
+            yield path, split_times
 
-def export_clips(video_path_list, clip_dir=None, split_thresh=5):
+def index_videos(video_path_list, check_freq=1, workers=None, scan_mode='auto'):
+    """
+    Build the frame index of every video up front so later planning never decodes video. Returns paths that failed.
+    """
+    video_paths = [path for path in video_path_list if get_ext(path) in VIDEO_EXTENSIONS]
+    failed = []
+    with tqdm(total=len(video_paths)) as pbar:
+        for path, split_times in scan_videos(video_paths, check_freq=check_freq, workers=workers, ordered=False, scan_mode=scan_mode):
+            if not split_times:
+                failed += [path]
+            pbar.update(1)
+    return failed
+
+def iter_split_times(path_list, check_freq=1, split_thresh=5, max_time=5000, workers=1, ordered=True, scan_mode='auto', known_split_times=None):
+    """
+    Yield (path, split_times) for every video & image in path_list. Videos are scanned by scan_videos
+        max_time - clip length used for images
+        known_split_times - dict of path to split times used instead of scanning, see get_manifest_split_times
+    """
+    known_split_times = known_split_times if known_split_times else {}
+    video_paths = [path for path in path_list if get_ext(path) in VIDEO_EXTENSIONS and path not in known_split_times]
+    scanned = scan_videos(video_paths, check_freq=check_freq, split_thresh=split_thresh, workers=workers, ordered=ordered, scan_mode=scan_mode)
+
+    for path in path_list:
+        ext = get_ext(path)
+        if path in known_split_times:
+            yield path, known_split_times[path]
+        elif ext in IMG_EXTENSIONS:
+            yield path, [(0, max_time)]
+        elif ext in VIDEO_EXTENSIONS and ordered:
+            yield next(scanned)
+
+    if not ordered:
+        yield from scanned
+
+def get_keyframe_times(vid_filename):
+    """
+    Keyframe times [s] & fps of a video, read from the container index without decoding.
+    No keyframes if decord can't open the video.
+    """
+    try:
+        vr = VideoReader(vid_filename, ctx=cpu(0))
+        fps = vr.get_avg_fps()
+        return np.array(vr.get_key_indices()) / fps, fps
+    except Exception:
+        return np.array([]), 0
+
+def load_clip_manifest(clip_dir):
+    """
+    Clip directory manifest, a dict of clip filename to clip info. Empty if the directory has no manifest yet.
+    """
+    manifest_path = os.path.join(clip_dir, CLIP_MANIFEST_FILENAME)
+    if not os.path.exists(manifest_path):
+        return {}
+    return json.load(open(manifest_path, 'r'))
+
+def save_clip_manifest(clip_dir, manifest):
+    manifest_path = os.path.join(clip_dir, CLIP_MANIFEST_FILENAME)
+    with open(manifest_path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+def probe_clip(path):
+    """
+    Duration [s], fps, width & height of a video without decoding it. Images have no duration or fps.
+    """
+    if get_ext(path) in IMG_EXTENSIONS:
+        with PIL.Image.open(path) as img:
+            width, height = img.size
+        return {'duration': None, 'fps': None, 'width': width, 'height': height}
+
+    cap = cv2.VideoCapture(path)
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    frame_cnt = cap.get(cv2.CAP_PROP_FRAME_COUNT)
+    info = {'duration': frame_cnt / fps if fps > 0 else None, 'fps': fps, 'width': int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            'height': int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))}
+    cap.release()
+    return info
+
+def update_clip_manifest(clip_dir):
+    """
+    Add size, modified time, content hash, duration, fps & resolution of every clip in clip_dir to its manifest.
+    Only new or modified clips are probed, clips no longer in the directory are dropped. Returns the manifest.
+    """
+    manifest = load_clip_manifest(clip_dir)
+    clip_names = [f for f in os.listdir(clip_dir) if get_ext(f) in VIDEO_EXTENSIONS + IMG_EXTENSIONS]
+
+    updated = False
+    for name in set(manifest) - set(clip_names):
+        del manifest[name]
+        updated = True
+
+    for name in tqdm(clip_names):
+        path = os.path.join(clip_dir, name)
+        stat = os.stat(path)
+        entry = manifest.get(name, {})
+        if (entry.get('size'), entry.get('mtime')) == (stat.st_size, stat.st_mtime_ns):
+            continue
+
+        entry.update(probe_clip(path))
+        entry.update({'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'hash': get_file_hash(path)})
+        manifest[name] = entry
+        updated = True
+
+    if updated:
+        save_clip_manifest(clip_dir, manifest)
+    return manifest
+
+def get_manifest_split_times(clip_dir, manifest):
+    """
+    Each clip in a clip directory is already a single scene, use the whole clip instead of scanning it again.
+    Returns dict of clip path to split times for clips with a known duration.
+    """
+    return {os.path.join(clip_dir, name): [(0, entry['duration'])] for name, entry in manifest.items() if entry.get('duration')}
+
+def _export_clip(job):
+    video_path, start_time, stop_time, clip_path, stream_copy = job
+    cmd = [FFMPEG_BIN, '-y', '-loglevel', 'error', '-ss', f'{start_time:.6f}', '-i', video_path, '-t', f'{stop_time - start_time:.6f}',
+           '-map', '0:v:0', '-map', '0:a?']
+    if stream_copy:
+        cmd += ['-c', 'copy', '-avoid_negative_ts', 'make_zero']
+    else:
+        cmd += ['-c:v', 'libx264', '-preset', 'veryfast', '-crf', '18', '-c:a', 'aac']
+    subprocess.run(cmd + [clip_path], check=True)
+
+def export_clips(video_path_list, clip_dir=None, split_thresh=5, workers=1, scan_mode='auto'):
+    """
+    Cut every scene of every video in to its own clip file in clip_dir, numbered after the clips already there.
+    Clips starting on a keyframe are stream copied, others are re-encoded. Each clip's source, times, size & hash are added to
+    the clip directory manifest.
+        workers - processes scanning videos & ffmpeg exports running at the same time
+    """
     if clip_dir == None:
         clip_dir = os.path.join('Media', 'Clips')
 
     if not (os.path.exists(clip_dir)):
         os.mkdir(clip_dir)
 
-    for video_path, clip_times in get_clip_times(video_path_list, shuffle=False, use_once=True, split_thresh=split_thresh):
-        video = VideoFileClip(video_path)
+    next_idx = get_next_path_index(clip_dir, ext_list=VIDEO_EXTENSIONS)
+    jobs = []
+    manifest = load_clip_manifest(clip_dir)
+    for video_path, clip_times in get_clip_times(video_path_list, shuffle=False, use_once=True, split_thresh=split_thresh, workers=workers, scan_mode=scan_mode):
+        if get_ext(video_path) not in VIDEO_EXTENSIONS:
+            continue
+
+        keyframe_times, fps = get_keyframe_times(video_path)
+        source_info = probe_clip(video_path)  # Clips keep their source's fps & resolution
 
         for start_time, stop_time in clip_times:
-            clip_name = str(get_next_path_index(clip_dir, ext_list=VIDEO_EXTENSIONS)) + '.mp4'
+            if stop_time <= start_time:
+                continue
+
+            clip_name = str(next_idx) + '.mp4'
+            next_idx += 1
+
+            # Stream copy starts at the keyframe before start_time, only exact if start_time is on a keyframe
+            stream_copy = len(keyframe_times) > 0 and np.min(np.abs(keyframe_times - start_time)) < 0.5 / fps
+            jobs += [(video_path, start_time, stop_time, os.path.join(clip_dir, clip_name), stream_copy)]
+            manifest[clip_name] = {'source': video_path, 'start': start_time, 'stop': stop_time, 'duration': stop_time - start_time,
+                                   'stream_copy': bool(stream_copy), 'fps': source_info['fps'], 'width': source_info['width'],
+                                   'height': source_info['height']}
+
+    # Each worker only waits on an ffmpeg process so threads are enough
+    with ThreadPool(workers) as pool:
+        with tqdm(total=len(jobs)) as pbar:
+            for _ in pool.imap_unordered(_export_clip, jobs):
+                pbar.update(1)
 
-            clip = video.subclip(start_time, stop_time)
-            clip.write_videofile(os.path.join(clip_dir, clip_name), verbose=False)
+    # Same fields update_clip_manifest checks, so exported clips aren't probed again
+    for _, _, _, clip_path, _ in jobs:
+        stat = os.stat(clip_path)
+        manifest[os.path.basename(clip_path)].update({'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'hash': get_file_hash(clip_path)})
 
-def get_clip_times(video_path_list, split_thresh=5, use_once=False, shuffle=False, frame_check_freq=1, max_time=5000, chunk_size=20):
+    save_clip_manifest(clip_dir, manifest)
+
+def get_clip_times(video_path_list, split_thresh=5, use_once=False, shuffle=False, frame_check_freq=1, max_time=5000, chunk_size=20, workers=1, scan_mode='auto', known_split_times=None):
     """
     Iterate video frames, split at scene changes, and create clips to yield back
         video_path_list - a list of paths to all videos being iterated on
         shuffle - shuffle clips if True else use in order they are listed
         frame_check_freq - how often in seconds to compare frames for scene change
+        workers - number of processes scanning videos concurrently
+        scan_mode - how video frames are sampled, see get_frame_means
+        known_split_times - dict of path to split times used instead of scanning those videos
     """
     assert len(video_path_list) > 0, "Empty video path list."
 
     while True:
         video_path_list = shuffle_in_chunks(video_path_list, chunk_size=1) if shuffle else video_path_list
         invalid_videos = []
-        for video_cnt, path in enumerate(video_path_list):
+        for path, split_times in iter_split_times(video_path_list, check_freq=frame_check_freq, split_thresh=split_thresh, max_time=max_time, workers=workers, scan_mode=scan_mode, known_split_times=known_split_times):
             if path in invalid_videos:
                 continue
 
-            ext = get_ext(path)
-            if ext in VIDEO_EXTENSIONS:
-                split_times = get_video_split_times(path, check_freq=frame_check_freq, split_thresh=split_thresh)
-                if not split_times:
-                    invalid_videos += [path]
-                    continue
-            elif ext in IMG_EXTENSIONS:
-                split_times = [(0, max_time)]
+            if not split_times:
+                invalid_videos += [path]
+                continue
 
             if shuffle:
                 split_times = shuffle_in_chunks(split_times, chunk_size=chunk_size)
@@ -123,23 +441,147 @@ def get_clip_times(video_path_list, split_thresh=5, use_once=False, shuffle=Fals
             print('No valid videos found.')
             exit(0)
 
-def build_musicvideo_clips(video_path_list, audio_split_times, shuffle=False, use_once=False, init_thresh=5, thresh_inc=5, max_thresh=20, chunk_size=20, video_height=1080):
+def is_unused(used, path, start_time, stop_time):
+    """
+    True if [start_time, stop_time] of path overlaps none of the used dict of path to (start, stop) ranges
+    """
+    return all(stop_time <= used_start or used_stop <= start_time for used_start, used_stop in used.get(path, []))
+
+class ClipPool:
+    """
+    Clips sorted by length so a clip longer than an audio cut is found by bisection. Clips are removed once taken.
+    """
+    def __init__(self, clips):
+        """
+        clips - list of (path, start_time, stop_time)
+        """
+        self.clips = sorted(clips, key=lambda clip: clip[2] - clip[1])
+        self.lens = [stop_time - start_time for _, start_time, stop_time in self.clips]
+        self.taken = 0
+
+    def __len__(self):
+        return len(self.clips)
+
+    def take(self, min_len, random=False, accept=None):
+        """
+        Remove & return the shortest clip longer than min_len, or a random one of the clips longer than min_len.
+        None if no clip is long enough.
+            accept - function of a clip, clips it returns False for are removed & skipped
+        """
+        while True:
+            i = bisect.bisect_right(self.lens, min_len)
+            if i == len(self.lens):
+                return None
+            if random:
+                i = np.random.randint(i, len(self.lens))
+
+            self.lens.pop(i)
+            clip = self.clips.pop(i)
+            if accept is None or accept(clip):
+                self.taken += 1
+                return clip
+
+def plan_cuts_from_pool(video_path_list, audio_split_times, shuffle=False, use_once=False, init_thresh=5, thresh_inc=5, max_thresh=20, global_fit=False, workers=1, scan_mode='auto', known_split_times=None):
+    """
+    plan_musicvideo_cuts matching each audio cut against a ClipPool of every clip in the library.
+    A pool is built per split threshold, higher thresholds are only tried when no clip is long enough.
+        shuffle - pick a random clip that fits instead of the shortest
+        use_once - never reuse any part of a video, at any threshold. Otherwise the pool is refilled once every clip has been used
+        global_fit - fill the longest audio cuts first so long clips aren't used up by short cuts
+    The music video stops at the first audio cut no clip fits. With global_fit it is the longest start of the song every cut can be filled for.
+    """
+    audio_cut_lens = np.diff(audio_split_times)  # Get the time delta between times (audio delta to next beat [s])
+    thresholds = np.arange(init_thresh, max_thresh, thresh_inc).tolist()
+
+    clips = {}
+    def get_clips(thresh):
+        if thresh not in clips:
+            split_times = iter_split_times(video_path_list, split_thresh=thresh, workers=workers, scan_mode=scan_mode, known_split_times=known_split_times)
+            clips[thresh] = [(path, start_time, stop_time) for path, clip_times in split_times for start_time, stop_time in clip_times]
+        return clips[thresh]
+
+    def plan(cut_cnt):
+        """
+        Cuts for the first cut_cnt audio cuts, None where no clip fits
+        """
+        pools = {}
+        used = {}  # path: (start, stop) ranges already in the music video, shared by the pools of every threshold
+
+        def take(thresh, cut_len):
+            if thresh not in pools:
+                pools[thresh] = ClipPool(get_clips(thresh))
+            clip = pools[thresh].take(cut_len, random=shuffle, accept=(lambda clip: is_unused(used, *clip)) if use_once else None)
+            if clip is None and not use_once and pools[thresh].taken > 0: # Start reusing clips
+                pools[thresh] = ClipPool(get_clips(thresh))
+                clip = pools[thresh].take(cut_len, random=shuffle)
+            return clip
+
+        lens = audio_cut_lens[:cut_cnt]
+        cuts = [None] * len(lens)
+        for k in (np.argsort(-lens, kind='stable') if global_fit else range(len(lens))):
+            clip = None
+            for thresh in thresholds:
+                clip = take(thresh, lens[k])
+                if clip:
+                    break
+                count('threshold_retries')
+
+            if clip is None:
+                if global_fit:
+                    continue
+                print(f'No video clips long enough for audio cut {k}, length {lens[k]}')
+                break
+
+            path, start_time, _ = clip
+            cuts[k] = (path, start_time, float(lens[k]))
+            used.setdefault(path, []).append((start_time, start_time + float(lens[k])))
+        return cuts
+
+    cuts = plan(len(audio_cut_lens))
+    if global_fit and None in cuts:
+        # Fewer cuts leave more clips for the rest, search for the longest start of the song that can be filled
+        low, high = 0, len(audio_cut_lens) - 1
+        cuts = []
+        while low < high:
+            mid = (low + high + 1) // 2
+            prefix_cuts = plan(mid)
+            if None in prefix_cuts:
+                high = mid - 1
+            else:
+                low, cuts = mid, prefix_cuts
+        print(f'Video clips fill the first {len(cuts)} of {len(audio_cut_lens)} audio cuts.')
+
+    return cuts[:cuts.index(None)] if None in cuts else cuts
+
+def plan_musicvideo_cuts(video_path_list, audio_split_times, shuffle=False, use_once=False, init_thresh=5, thresh_inc=5, max_thresh=20, chunk_size=20, workers=1, scan_mode='auto', match='sequential', known_split_times=None):
+    """
+    Choose a video clip for every audio cut without opening any videos for decoding.
+    Returns a list of (path, start_time, duration) cuts, one per audio cut in order.
+        match - sequential: use clips in video order, pool & global: see plan_cuts_from_pool
+        known_split_times - dict of path to split times used instead of scanning those videos
+    """
+    assert match in MATCH_MODES, f'Unknown match mode {match}. Use one of {MATCH_MODES}'
+    if match != 'sequential':
+        return plan_cuts_from_pool(video_path_list, audio_split_times, shuffle=shuffle, use_once=use_once, init_thresh=init_thresh, thresh_inc=thresh_inc,
+                                   max_thresh=max_thresh, global_fit=(match == 'global'), workers=workers, scan_mode=scan_mode,
+                                   known_split_times=known_split_times)
 
     with tqdm(total=len(audio_split_times)) as pbar:  # Create progress bar
 
         audio_cut_lens = np.diff(audio_split_times)  # Get the time delta between times (audio delta to next beat [s])
 
-        mv_clips = []
+        cuts = []
+        used = {}  # path: (start, stop) ranges already in the music video, with use_once clips overlapping them are skipped at every threshold
 
         audio_cut_len = audio_cut_lens[0]
 
         thresh = init_thresh
-        prev_clip_len = 0
+        prev_cut_cnt = 0
         while thresh < max_thresh:
 
             short_list = []
-            for path, clip_times in get_clip_times(video_path_list, shuffle=shuffle, use_once=use_once, split_thresh=thresh, chunk_size=chunk_size):
-                init_video = False
+            for path, clip_times in get_clip_times(video_path_list, shuffle=shuffle, use_once=use_once, split_thresh=thresh, chunk_size=chunk_size, workers=workers, scan_mode=scan_mode,
+                                               known_split_times=known_split_times):
 
                 # Continue if no clips found that are long enough for audio cut, break if all videos tried
                 max_clip_len = max([stop-start for start, stop in clip_times])
@@ -156,38 +598,104 @@ def build_musicvideo_clips(video_path_list, audio_split_times, shuffle=False, us
                     clip_len = stop_time - start_time
 
                     # Video clip must be longer than audio split time so clip can be trimmed down to match audio len
-                    if clip_len > audio_cut_len:
-
-                        # Initialize VideoFileClip from video path
-                        if not(init_video):
-                            if path.split('.')[-1] in VIDEO_EXTENSIONS:
-                                video = VideoFileClip(path)
-                            elif path.split('.')[-1] in IMG_EXTENSIONS:
-                                video = ImageClip(path).set_pos(("center", "center"))
+                    if clip_len > audio_cut_len and (not use_once or is_unused(used, path, start_time, stop_time)):
+                        cuts += [(path, start_time, float(audio_cut_len))]
+                        used.setdefault(path, []).append((start_time, start_time + float(audio_cut_len)))
 
-
-                            video = video.resize((1920, 1080))
-
-                            init_video = True
-
-                        # Add video clip to music video
-                        mv_clips += [video.subclip(start_time, start_time + audio_cut_len)]
-                        video.close()
-
-                        # Number of clips is still less than needed to finish music video
-                        if len(mv_clips) < len(audio_cut_lens):
-                            print(f'')
-                            audio_cut_len = audio_cut_lens[len(mv_clips)]
+                        # Number of cuts is still less than needed to finish music video
+                        if len(cuts) < len(audio_cut_lens):
+                            audio_cut_len = audio_cut_lens[len(cuts)]
                             pbar.update(1)  # Update progress bar
-                        else:  # All clips created to match audio beats
-                            return mv_clips # List filled to completion
+                        else:  # All cuts chosen to match audio beats
+                            return cuts # List filled to completion
 
-            if (len(mv_clips) - prev_clip_len) == 0:
+            if (len(cuts) - prev_cut_cnt) == 0:
                 print(f'No clips added using threshold {thresh}. Trying increased split threshold {thresh + thresh_inc}.')
+                count('threshold_retries')
                 thresh += thresh_inc
             else:
                 thresh = init_thresh
 
-            prev_clip_len = len(mv_clips)
+            prev_cut_cnt = len(cuts)
+
+        return cuts # Stopped short of completion
 
-        return mv_clips # Stopped short of completion
\ No newline at end of file
+def get_proxy(path, height=PROXY_HEIGHT):
+    """
+    Path of a low resolution copy of a video where every frame is a keyframe, so any frame decodes without decoding
+    the ones before it. Made once per video content & height and pinned in the cache, plans refer to proxies by path.
+    """
+    key = make_key('proxy', get_file_hash(path), height)
+    proxy_path = get_cached_path(key, '.mkv', pinned=True)
+    if proxy_path:
+        return proxy_path
+
+    cmd = [FFMPEG_BIN, '-loglevel', 'error', '-i', path, '-map', '0:v:0', '-vf', f'scale=-2:{height}',
+           '-c:v', 'libx264', '-preset', 'ultrafast', '-g', '1', '-crf', '23', '-pix_fmt', 'yuv420p', '-f', 'matroska', '-']
+    return store_file(key, '.mkv', lambda f: subprocess.run(cmd, stdout=f, check=True), pinned=True)
+
+def make_proxies(video_path_list, height=PROXY_HEIGHT, workers=None):
+    """
+    get_proxy for every video, workers ffmpeg processes at a time. Images are their own proxy.
+    Returns dict of path to proxy path
+    """
+    video_paths = [path for path in video_path_list if get_ext(path) in VIDEO_EXTENSIONS]
+    with ThreadPool(workers if workers else os.cpu_count()) as pool:  # Each thread just waits on ffmpeg
+        proxy_paths = list(tqdm(pool.imap(lambda path: get_proxy(path, height=height), video_paths), total=len(video_paths)))
+
+    proxies = {path: path for path in video_path_list}
+    proxies.update(zip(video_paths, proxy_paths))
+    return proxies
+
+def get_still(path, size=(1920, 1080)):
+    """
+    Path of image path scaled up or down to fit size & centered on black, cached so each image is only decoded & scaled once.
+    JPEGs larger than size are decoded at the smallest scale still larger than size instead of at full resolution.
+    """
+    key = make_key('still', get_file_hash(path), list(size), 'fit')
+    still_path = get_cached_path(key, '.jpg')
+    if still_path:
+        return still_path
+
+    with PIL.Image.open(path) as img:
+        if img.width > size[0] or img.height > size[1]:
+            img.draft('RGB', size)
+        img = img.convert('RGB')
+    scale = min(size[0] / img.width, size[1] / img.height)
+    fit_size = (max(1, min(size[0], round(img.width * scale))), max(1, min(size[1], round(img.height * scale))))
+    if fit_size != img.size:
+        img = img.resize(fit_size, PIL.Image.LANCZOS)
+
+    still = PIL.Image.new('RGB', size)
+    still.paste(img, ((size[0] - img.width) // 2, (size[1] - img.height) // 2))
+    return store_file(key, '.jpg', lambda f: still.save(f, format='JPEG', quality=STILL_QUALITY))
+
+def cuts_to_clips(cuts, size=(1920, 1080)):
+    """
+    MoviePy subclips for a list of (path, start_time, duration) cuts
+    """
+    mv_clips = []
+    prev_path = None
+    for path, start_time, duration in cuts:
+        # Initialize VideoFileClip from video path
+        if path != prev_path:
+            if get_ext(path) in VIDEO_EXTENSIONS:
+                video = VideoFileClip(path).resize(size)
+                count('videos_opened')
+            elif get_ext(path) in IMG_EXTENSIONS:
+                # Already at size, MoviePy reuses the same frame instead of resizing every output frame
+                with PIL.Image.open(get_still(path, size)) as img:
+                    video = ImageClip(np.array(img))
+
+            prev_path = path
+
+        # Add video clip to music video
+        mv_clips += [video.subclip(start_time, start_time + duration)]
+        video.close()
+
+    return mv_clips
+
+def build_musicvideo_clips(video_path_list, audio_split_times, shuffle=False, use_once=False, init_thresh=5, thresh_inc=5, max_thresh=20, chunk_size=20, video_height=1080, workers=1, scan_mode='auto'):
+    cuts = plan_musicvideo_cuts(video_path_list, audio_split_times, shuffle=shuffle, use_once=use_once, init_thresh=init_thresh, thresh_inc=thresh_inc,
+                                max_thresh=max_thresh, chunk_size=chunk_size, workers=workers, scan_mode=scan_mode)
+    return cuts_to_clips(cuts, size=get_frame_size(video_height))